@@ -3,22 +3,30 @@
 SeleniumSandbox application.
 """
 
+import Queue
+import StringIO
 import base64
+import collections
 import datetime
-import glob
 import hashlib
+import httplib
 import json
 import os
 import platform
 import re
 import shutil
 import signal
+import socket
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import time
 import urllib2
 import urlparse
 
+import objectStore
 import testrail
 
 from optparse import OptionParser
@@ -31,14 +39,18 @@ def ppjson(doc):
     print json.dumps(doc, sort_keys=True, indent=4, separators=(',', ': '))
 
 
-def get_site_version(url):
+def get_site_version(url, pool=None):
     """
     Get site version.
     """
     try:
-        request = urllib2.Request(url)
-        response = urllib2.urlopen(request)
+        if pool is not None:
+            response = pool.urlopen(url)
+        else:
+            request = urllib2.Request(url)
+            response = urllib2.urlopen(request)
         results = response.read()
+        response.close()
     except Exception as e:
         sys.stderr.write("Unexpected exception: %s \n" % e)
         sys.exit(1)
@@ -48,6 +60,53 @@ def get_site_version(url):
     return (version_name, version_hash)
 
 
+def format_duration(seconds):
+    """
+    Format a duration in seconds as hours, minutes and seconds.
+    """
+    (minutes, seconds) = divmod(int(seconds + 0.5), 60)
+    (hours, minutes) = divmod(minutes, 60)
+    if hours:
+        return "%dh%02dm%02ds" % (hours, minutes, seconds)
+    if minutes:
+        return "%dm%02ds" % (minutes, seconds)
+    return "%ds" % seconds
+
+
+def shard_of(case_id, shard_count):
+    """
+    Shard of a case, from a hash of its ID, so that it does not depend on
+    the other cases of the run.
+    """
+    return int(hashlib.sha1(str(case_id)).hexdigest(), 16) % shard_count
+
+
+def merge_results(result_files):
+    """
+    Merge the result files of several shards.
+
+    Returns the results of every run, as add_results_for_cases payloads.
+    A case found in several files keeps its result from the last one.
+    """
+    runs = {}
+    for result_file in result_files:
+        with open(result_file) as data_file:
+            doc = json.load(data_file)
+        for (run, results) in doc["runs"].items():
+            cases = runs.setdefault(int(run), collections.OrderedDict())
+            for result in results["results"]:
+                cases[result["case_id"]] = result
+    return dict((run, {"results": cases.values()}) for (run, cases) in runs.items())
+
+
+def save_results(result_file, runs):
+    """
+    Save the results of runs, as add_results_for_cases payloads by run.
+    """
+    with open(result_file, "w") as data_file:
+        json.dump({"runs": dict((str(run), results) for (run, results) in runs.items())}, data_file, indent=4, sort_keys=True)
+
+
 def locate_files(pattern, root=os.curdir):
     """
     Locate all files matching supplied filename pattern in and below
@@ -72,6 +131,60 @@ def locate_dirs(pattern, root=os.curdir):
             yield os.path.join(path, dirname)
 
 
+def get_synced_trees(git_folder, count):
+    """
+    Get the SHA-1 of the last trees a work folder was synchronized with,
+    most recent first.
+    """
+    shas = []
+    sync_log = os.path.join(git_folder, "logs", "SYNC_HEAD")
+    if os.path.exists(sync_log):
+        with open(sync_log) as log_file:
+            lines = log_file.read().splitlines()
+        for line in reversed(lines):
+            sha = line.split(" ")[0]
+            if sha and sha not in shas:
+                shas.append(sha)
+            if len(shas) >= count:
+                break
+    return shas
+
+
+def collect_garbage(work_folder, keep_trees=5, max_bytes=0, shared_objects_folder=None, shared_min_age=7 * 24 * 3600):
+    """
+    Collect the garbage of the object store of a work folder.
+
+    Every object reachable from the fetched tree (HEAD) and from the last
+    keep_trees synchronized trees is kept. Other objects are removed, least
+    recently used first, until the store fits in max_bytes.
+
+    The shared object cache, if any, holds the objects of other work
+    folders too, which this one knows nothing of: it is only trimmed to
+    max_bytes when one is given, and of objects none used for
+    shared_min_age seconds. Returns the number of objects and of bytes
+    reclaimed.
+    """
+    git_folder = os.path.join(work_folder, ".git")
+    roots = get_synced_trees(git_folder, keep_trees)
+    head_file = os.path.join(git_folder, "HEAD")
+    if os.path.exists(head_file):
+        with open(head_file) as data_file:
+            roots.append(data_file.read().strip())
+
+    stores = [objectStore.ObjectStore(os.path.join(git_folder, "objects"))]
+    if shared_objects_folder and os.path.exists(shared_objects_folder):
+        stores.append(objectStore.ObjectStore(shared_objects_folder))
+        stores[0].shared = stores[1]
+    keep = stores[0].reachable(roots)
+
+    (count, size) = stores[0].collect_garbage(keep, max_bytes)
+    if len(stores) > 1 and max_bytes > 0:
+        reclaimed = stores[1].collect_garbage(keep, max_bytes, shared_min_age)
+        count += reclaimed[0]
+        size += reclaimed[1]
+    return (count, size)
+
+
 class SuiteNotFound(Exception):
     """
     Suite not found exception.
@@ -108,6 +221,18 @@ class GitHubError(Exception):
         super(GitHubError, self).__init__(message)
 
 
+class GitHubRateLimitExceeded(GitHubError):
+    """
+    GitHub rate limit exceeded exception.
+    """
+
+    def __init__(self, message):
+        """
+        Constructor.
+        """
+        super(GitHubRateLimitExceeded, self).__init__(message)
+
+
 class TestRailError(Exception):
     """
     TestRail error exception.
@@ -216,13 +341,725 @@ class UnsupportedBranch(Exception):
         super(UnsupportedBranch, self).__init__(message)
 
 
-class SeleniumSandbox:
+class PooledResponse:
+    """
+    Response of a pooled HTTP connection.
+
+    Behaves like the responses of urllib2.urlopen. The connection is handed
+    back to the pool once the body has been read completely and the
+    response closed.
+    """
+
+    def __init__(self, pool, key, connection, response, url):
+        """
+        Constructor.
+        """
+        self.pool = pool
+        self.key = key
+        self.connection = connection
+        self.response = response
+        self.url = url
+        self.code = response.status
+        self.msg = response.msg
+
+    def read(self, amt=None):
+        """
+        Read the body.
+        """
+        return self.response.read(amt)
+
+    def info(self):
+        """
+        Headers of the response.
+        """
+        return self.msg
+
+    def getcode(self):
+        """
+        HTTP status code.
+        """
+        return self.code
+
+    def geturl(self):
+        """
+        URL of the response.
+        """
+        return self.url
+
+    def close(self):
+        """
+        Close the response and release its connection.
+        """
+        if self.connection is None:
+            return
+        reusable = self.response.isclosed() and not self.response.will_close
+        if not reusable:
+            self.response.close()
+            self.connection.close()
+        self.pool.release(self.key, self.connection, reusable)
+        self.connection = None
+
+
+class HTTPConnectionPool:
+    """
+    Pool of keep-alive HTTP connections.
+
+    At most size connections are in use at any time, and the idle ones are
+    kept open per host to be reused by the next requests, saving a TCP and
+    TLS handshake each time.
+    """
+
+    max_redirects = 5
+    # GitHub rejects requests without a User-Agent.
+    user_agent = "sg-automation"
+
+    def __init__(self, size=4, timeout=60):
+        """
+        Constructor.
+        """
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.idle = {}
+        self.new_connections = 0
+        self.reused_connections = 0
+
+    def acquire(self, key, fresh=False):
+        """
+        Get a connection to a (scheme, host) key.
+        """
+        with self.lock:
+            idle = self.idle.get(key, [])
+            if idle and not fresh:
+                self.reused_connections += 1
+                return (idle.pop(), True)
+            self.new_connections += 1
+        (scheme, netloc) = key
+        if scheme == "https":
+            return (httplib.HTTPSConnection(netloc, timeout=self.timeout), False)
+        return (httplib.HTTPConnection(netloc, timeout=self.timeout), False)
+
+    def release(self, key, connection, reusable=True):
+        """
+        Hand a connection back to the pool.
+        """
+        with self.lock:
+            if reusable:
+                idle = self.idle.setdefault(key, [])
+                if len(idle) < self.size:
+                    idle.append(connection)
+                else:
+                    connection.close()
+        self.slots.release()
+
+    def close(self):
+        """
+        Close all the idle connections.
+        """
+        with self.lock:
+            for idle in self.idle.values():
+                for connection in idle:
+                    connection.close()
+            self.idle = {}
+
+    def stats(self):
+        """
+        Connection counters.
+        """
+        with self.lock:
+            return {"new": self.new_connections, "reused": self.reused_connections}
+
+    def request(self, key, path, headers):
+        """
+        Send a GET request over a pooled connection.
+
+        A kept-alive connection may have been closed by the server while
+        idle; the request is then sent again over a new connection.
+        """
+        (connection, reused) = self.acquire(key)
+        while True:
+            try:
+                connection.request("GET", path, headers=headers)
+                return (connection, connection.getresponse())
+            except (httplib.HTTPException, socket.error):
+                connection.close()
+                if not reused:
+                    raise
+                (connection, reused) = self.acquire(key, fresh=True)
+
+    def urlopen(self, url, headers=None):
+        """
+        Open an URL, following redirects.
+
+        HTTP errors are raised as urllib2.HTTPError, as urllib2.urlopen does.
+        """
+        headers = dict(headers or {})
+        headers.setdefault("User-Agent", self.user_agent)
+        for i in range(self.max_redirects + 1):
+            parts = urlparse.urlsplit(url)
+            key = (parts.scheme, parts.netloc)
+            path = urlparse.urlunsplit(("", "", parts.path or "/", parts.query, ""))
+            self.slots.acquire()
+            try:
+                (connection, response) = self.request(key, path, headers)
+            except Exception:
+                self.slots.release()
+                raise
+            pooled = PooledResponse(self, key, connection, response, url)
+            if response.status in (301, 302, 303, 307) and response.getheader("Location"):
+                pooled.read()
+                pooled.close()
+                location = urlparse.urljoin(url, response.getheader("Location"))
+                # Credentials are not handed over to other hosts.
+                if urlparse.urlsplit(location).netloc != parts.netloc:
+                    headers.pop("Authorization", None)
+                url = location
+                continue
+            if response.status >= 400:
+                body = pooled.read()
+                pooled.close()
+                raise urllib2.HTTPError(url, response.status, response.reason, response.msg, StringIO.StringIO(body))
+            return pooled
+        raise urllib2.HTTPError(url, response.status, "Too many redirects", response.msg, None)
+
+
+class RateLimiter:
+    """
+    Schedules the GitHub requests according to the API rate limits.
+
+    The X-RateLimit-* headers of every response tell how many requests are
+    left until the reset time. Since several agents may share a token, the
+    remaining budget is not ours alone: once it runs low, the requests are
+    spread evenly until the reset, and a reserve is always left untouched.
+    Requests rejected by a primary or secondary rate limit (403 or 429) are
+    retried after the delay requested by GitHub, or with an exponential
+    backoff when none is given.
+    """
+
+    def __init__(self, reserve=20, pace_ratio=0.2, max_retries=5, backoff=60, max_wait=3600):
+        """
+        Constructor.
+        """
+        self.reserve = reserve
+        self.pace_ratio = pace_ratio
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_wait = max_wait
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.in_flight = 0
+        self.last_request = 0
+        self.next_request = 0
+        self.waited = 0
+
+    def delay(self, now):
+        """
+        Seconds to wait before the next request may be sent.
+        """
+        if self.remaining is None or self.reset is None or self.reset <= now:
+            return max(0, self.next_request - now)
+        budget = self.remaining - self.in_flight - self.reserve
+        if budget <= 0:
+            return self.reset - now + 1
+        if self.limit and self.remaining < self.limit * self.pace_ratio:
+            interval = (self.reset - now) / float(budget)
+            return max(0, self.next_request - now, self.last_request + interval - now)
+        return max(0, self.next_request - now)
+
+    def acquire(self):
+        """
+        Wait for our turn to send a request.
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                wait = self.delay(now)
+                if wait <= 0:
+                    self.in_flight += 1
+                    self.last_request = now
+                    return
+            if wait > self.max_wait:
+                raise GitHubRateLimitExceeded("GitHub rate limit exhausted until %s" % time.ctime(self.reset or now + wait))
+            self.waited += wait
+            time.sleep(wait)
+
+    def update(self, headers):
+        """
+        Record the rate limit state from the headers of a response.
+        """
+        with self.lock:
+            self.in_flight = max(0, self.in_flight - 1)
+            if headers is None:
+                return
+            try:
+                if headers.getheader("X-RateLimit-Limit") is not None:
+                    self.limit = int(headers.getheader("X-RateLimit-Limit"))
+                if headers.getheader("X-RateLimit-Remaining") is not None:
+                    self.remaining = int(headers.getheader("X-RateLimit-Remaining"))
+                if headers.getheader("X-RateLimit-Reset") is not None:
+                    self.reset = int(headers.getheader("X-RateLimit-Reset"))
+            except ValueError:
+                pass
+
+    def retry_delay(self, error, attempt):
+        """
+        Seconds to wait before retrying a request rejected by GitHub, or None
+        when the error is not caused by a rate limit.
+        """
+        if error.code not in (403, 429):
+            return None
+        headers = error.hdrs
+        retry_after = headers.getheader("Retry-After") if headers else None
+        if retry_after and retry_after.isdigit():
+            return int(retry_after)
+        if headers and headers.getheader("X-RateLimit-Remaining") == "0" and headers.getheader("X-RateLimit-Reset"):
+            return max(1, int(headers.getheader("X-RateLimit-Reset")) - int(time.time()) + 1)
+        body = ""
+        if error.fp is not None:
+            body = error.read()
+        if error.code == 429 or "rate limit" in body.lower():
+            return self.backoff * 2 ** attempt
+        return None
+
+    def hold(self, wait):
+        """
+        Hold all the requests for a while, following a secondary rate limit.
+        """
+        with self.lock:
+            self.next_request = max(self.next_request, time.time() + wait)
+
+
+class WorkerPool:
+    """
+    Bounded pool of worker threads, used to download git objects and to
+    write the files of the work folder.
+
+    Jobs are queued through submit() and block the caller once the queue is
+    full, so the producer never gets too far ahead of the workers. The
+    first exception raised by a job is re-raised by join().
+    """
+
+    def __init__(self, workers):
+        """
+        Constructor.
+        """
+        self.workers = max(1, workers)
+        self.queue = Queue.Queue(self.workers * 4)
+        self.lock = threading.Lock()
+        self.cancelled = False
+        self.errors = []
+        self.submitted = 0
+        self.completed = 0
+        self.threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.work, name="WorkerPool-%d" % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        """
+        Worker thread main loop.
+        """
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                break
+            (func, args) = job
+            try:
+                # Once a job failed, drain the queue without doing more work.
+                if not (self.errors or self.cancelled):
+                    func(*args)
+            except Exception:
+                with self.lock:
+                    self.errors.append(sys.exc_info())
+            finally:
+                with self.lock:
+                    self.completed += 1
+                self.queue.task_done()
+
+    def submit(self, func, *args):
+        """
+        Queue a job.
+        """
+        if self.errors:
+            self.raise_error()
+        with self.lock:
+            self.submitted += 1
+        while True:
+            # Waiting with a timeout keeps the main thread responsive to
+            # SIGINT and SIGTERM while the queue is full.
+            try:
+                self.queue.put((func, args), True, 0.1)
+                return
+            except Queue.Full:
+                if self.errors:
+                    self.raise_error()
+
+    def cancel(self):
+        """
+        Skip all the jobs that have not started yet.
+        """
+        self.cancelled = True
+
+    def join(self):
+        """
+        Wait for all the queued jobs and stop the workers.
+        """
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            # Joining with a timeout keeps the main thread responsive to
+            # SIGINT and SIGTERM.
+            while thread.is_alive():
+                thread.join(0.1)
+        if self.errors:
+            self.raise_error()
+
+    def raise_error(self):
+        """
+        Re-raise the first error of a job.
+        """
+        (exc_type, exc_value, exc_traceback) = self.errors[0]
+        raise exc_type, exc_value, exc_traceback
+
+
+class StatCache:
+    """
+    Index of the files synchronized in the work folder.
+
+    Like the git index, it maps the path of every file to its size,
+    modification time, inode and SHA-1, so that a file whose stat data did
+    not change does not have to be hashed again. An entry modified after
+    the index was last saved may have changed within the same timestamp
+    granularity, and is not trusted.
+    """
+
+    version = 1
+
+    def __init__(self, index_file):
+        """
+        Constructor.
+        """
+        self.index_file = index_file
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.seen = set()
+        self.timestamp = 0
+        if os.path.exists(index_file):
+            try:
+                with open(index_file) as data_file:
+                    doc = json.load(data_file)
+                if doc.get("version") == StatCache.version:
+                    self.entries = doc["entries"]
+                    self.timestamp = StatCache.stat_key(os.stat(index_file))[1]
+            except ValueError:
+                pass
+
+    @staticmethod
+    def stat_key(stat_info):
+        """
+        The (size, mtime_ns, inode) of a file.
+        """
+        return [stat_info.st_size, int(round(stat_info.st_mtime * 1e9)), stat_info.st_ino]
+
+    def lookup(self, path, stat_info):
+        """
+        SHA-1 of a file, or None when it has to be hashed.
+        """
+        with self.lock:
+            self.seen.add(path)
+            entry = self.entries.get(path)
+        key = StatCache.stat_key(stat_info)
+        if entry is not None and entry[:3] == key and key[1] < self.timestamp:
+            return entry[3]
+        return None
+
+    def update(self, path, stat_info, sha):
+        """
+        Record the SHA-1 of a file.
+        """
+        with self.lock:
+            self.seen.add(path)
+            self.entries[path] = StatCache.stat_key(stat_info) + [sha]
+
+    def remove(self, path):
+        """
+        Forget a file, or all the files of a folder.
+        """
+        folder = path + "/"
+        with self.lock:
+            for key in [x for x in self.entries if x == path or x.startswith(folder)]:
+                del self.entries[key]
+
+    def save(self, prune=False):
+        """
+        Save the entries, only those of the files seen since loaded if prune
+        is set.
+        """
+        entries = self.entries
+        if prune:
+            entries = dict((path, entry) for (path, entry) in entries.items() if path in self.seen)
+        (fd, temp_file) = tempfile.mkstemp(prefix="tmp_index_", dir=os.path.dirname(self.index_file))
+        with os.fdopen(fd, "w") as data_file:
+            json.dump({"version": StatCache.version, "entries": entries}, data_file)
+        os.rename(temp_file, self.index_file)
+
+
+class DurationHistory:
+    """
+    Durations of the tests, by case ID and site version.
+
+    The duration of a case on a site version it never ran on is estimated
+    from the version it last ran on.
+    """
+
+    version = 1
+
+    def __init__(self, history_file):
+        """
+        Constructor.
+        """
+        self.history_file = history_file
+        self.lock = threading.Lock()
+        self.durations = self.load()
+        self.recorded = {}
+
+    def load(self):
+        """
+        Load the durations saved, as {case ID: {version: [seconds, time]}}.
+        """
+        if os.path.exists(self.history_file):
+            try:
+                with open(self.history_file) as data_file:
+                    doc = json.load(data_file)
+                if doc.get("version") == DurationHistory.version:
+                    return doc["durations"]
+            except ValueError:
+                pass
+        return {}
+
+    def record(self, case_id, version, seconds):
+        """
+        Record the duration of a case on a site version.
+        """
+        entry = [seconds, time.time()]
+        with self.lock:
+            self.durations.setdefault(str(case_id), {})[version] = entry
+            self.recorded.setdefault(str(case_id), {})[version] = entry
+
+    def estimate(self, case_id, version):
+        """
+        Estimated duration of a case on a site version, or None.
+        """
+        with self.lock:
+            durations = self.durations.get(str(case_id))
+            if not durations:
+                return None
+            if version in durations:
+                return durations[version][0]
+            return max(durations.values(), key=lambda x: x[1])[0]
+
+    def save(self):
+        """
+        Save the durations, merged with those saved by other processes
+        since loaded.
+        """
+        with self.lock:
+            durations = self.load()
+            for (case_id, versions) in self.recorded.items():
+                durations.setdefault(case_id, {}).update(versions)
+            (fd, temp_file) = tempfile.mkstemp(prefix="tmp_durations_", dir=os.path.dirname(self.history_file))
+            with os.fdopen(fd, "w") as data_file:
+                json.dump({"version": DurationHistory.version, "durations": durations}, data_file)
+            os.chmod(temp_file, 0644)
+            os.rename(temp_file, self.history_file)
+            self.durations = durations
+            self.recorded = {}
+
+
+def get_testrail_client(testrail_token, testrail_server="https://meqa.autodesk.com", timeout=60):
+    """
+    Get a TestRail client from an email:api_key token.
+    """
+    (testrail_email, testrail_api_key) = testrail_token.split(":")
+    client = testrail.APIClient(testrail_server, timeout=timeout)
+    client.user = testrail_email
+    client.password = testrail_api_key
+    return client
+
+
+class ResultCommitter:
+    """
+    Commits TestRail results in the background, in batches.
+
+    Every result is appended to a journal before it is queued, and every
+    batch committed is marked in the journal, so that the results of an
+    interrupted run can be committed later with resume(). A batch is
+    committed once batch_size results are queued or interval seconds
+    passed since the last one. A batch which failed is kept for the next
+    one, sent no sooner than an exponential backoff, at most interval
+    seconds, later.
+    """
+
+    def __init__(self, client, journal_file, batch_size=20, interval=60, backoff=10):
+        """
+        Constructor.
+        """
+        self.client = client
+        self.journal_file = journal_file
+        self.batch_size = batch_size
+        self.interval = interval
+        self.backoff = backoff
+        self.condition = threading.Condition()
+        self.journal_lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.failures = 0
+        self.retry_time = 0
+        self.closing = False
+        self.committed = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.work, name="ResultCommitter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def journal(self, record):
+        """
+        Append a record to the journal, durably.
+        """
+        with self.journal_lock:
+            with open(self.journal_file, "a") as journal_file:
+                journal_file.write(json.dumps(record, sort_keys=True) + "\n")
+                journal_file.flush()
+                os.fsync(journal_file.fileno())
+
+    def add(self, run, result, journal=True):
+        """
+        Queue the result of a case of a run.
+        """
+        if journal:
+            self.journal({"type": "result", "run": run, "result": result})
+        with self.condition:
+            self.pending[(run, result["case_id"])] = result
+            if len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def resume(self, journal_file):
+        """
+        Queue the results of a journal which were never committed.
+
+        Results are keyed by run and case: a later result of a case
+        replaces an earlier one, and a case committed since is skipped.
+        Resuming the committer's own journal marks the results committed
+        in it, so replaying it again only commits what is left.
+        Returns the number of results queued.
+        """
+        results = collections.OrderedDict()
+        with open(journal_file) as data_file:
+            for line in data_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # The last line of an interrupted write.
+                    continue
+                if record["type"] == "result":
+                    key = (record["run"], record["result"]["case_id"])
+                    results.pop(key, None)
+                    results[key] = record["result"]
+                elif record["type"] == "sent":
+                    for case_id in record["case_ids"]:
+                        results.pop((record["run"], case_id), None)
+        journal = os.path.abspath(journal_file) != os.path.abspath(self.journal_file)
+        for ((run, case_id), result) in results.items():
+            self.add(run, result, journal)
+        return len(results)
+
+    def work(self):
+        """
+        Committer thread main loop.
+        """
+        while True:
+            with self.condition:
+                deadline = max(time.time() + self.interval, self.retry_time)
+                while not self.closing and time.time() < deadline and (len(self.pending) < self.batch_size or time.time() < self.retry_time):
+                    self.condition.wait(max(0, min(1, deadline - time.time())))
+                if self.closing:
+                    break
+            self.flush()
+        # A single attempt, as the process may be shutting down: what fails
+        # is left in the journal.
+        self.flush()
+
+    def flush(self):
+        """
+        Commit the queued results, one batch per run.
+
+        Once a batch fails, the next ones are not sent either, and all of
+        them are kept for the next flush.
+        """
+        with self.condition:
+            batch = self.pending
+            self.pending = collections.OrderedDict()
+        runs = collections.OrderedDict()
+        for ((run, case_id), result) in batch.items():
+            runs.setdefault(run, []).append(result)
+        failed = False
+        for (run, results) in runs.items():
+            if not failed:
+                try:
+                    self.post(run, results)
+                    self.failures = 0
+                    continue
+                except Exception as e:
+                    self.error = e
+                    self.failures += 1
+                    self.retry_time = time.time() + min(self.interval, self.backoff * 2 ** (self.failures - 1))
+                    failed = True
+            with self.condition:
+                for result in results:
+                    self.pending.setdefault((run, result["case_id"]), result)
+
+    def post(self, run, results):
+        """
+        Post the results of a run.
+        """
+        self.client.send_post('add_results_for_cases/%s' % run, {"results": results})
+        self.journal({"type": "sent", "run": run, "case_ids": [result["case_id"] for result in results]})
+        self.committed += len(results)
+
+    def close(self):
+        """
+        Commit the remaining results and stop the committer thread.
+
+        Returns the number of results left uncommitted.
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify()
+        while self.thread.is_alive():
+            # Joining with a timeout keeps the main thread responsive to
+            # SIGINT and SIGTERM.
+            self.thread.join(0.1)
+        return len(self.pending)
+
+
+class SeleniumSandbox(object):
     """
     Selenium Sandbox.
     """
 
     __version__ = "1.0"
 
+    github_repo = "shotgunsoftware/shotgun"
+    fetch_modes = ["walk", "recursive", "archive"]
+    checkout_modes = ["copy", "link"]
+    # Folders every case depends on.
+    shared_folders = ["library", "config", "suites/config"]
+
     # @TODO: These settings should be obtained from the TestRail server.
     # @FIXME: values are hardcoded for the moment.
     testrail_statuses = {
@@ -243,21 +1080,45 @@ class SeleniumSandbox:
         "Safari": 40,
     }
 
-    def __init__(self, git_token, testrail_token=None, debugging=False, testrail_server="https://meqa.autodesk.com", testrail_project="Shotgun"):
+    def __init__(self, git_token, testrail_token=None, debugging=False, testrail_server="https://meqa.autodesk.com", testrail_project="Shotgun", fetch_workers=4, sync_workers=4, fetch_mode="recursive", github_url="https://api.github.com", http_pool_size=4, work_folder=None, compress_objects=False, checkout_mode="copy", shared_objects_folder=None, commit_batch_size=20, commit_interval=60, testrail_timeout=60):
         """
         Constructor.
         """
         self.command_file = "runTest.command"
         self.git_token = git_token
+        self.fetch_workers = fetch_workers
+        self.sync_workers = sync_workers
+        self.fetch_mode = fetch_mode
+        self.compress_objects = compress_objects
+        self.checkout_mode = checkout_mode
+        self.shared_objects_folder = shared_objects_folder
+        self.checkout_stats = {"reflink": 0, "hardlink": 0, "copy": 0}
+        self.github_url = github_url
+        self.github_repo_url = "%s/repos/%s" % (github_url, SeleniumSandbox.github_repo)
+        # base64string = base64.encodestring("%s:%s" % (self.git_token, "x-oauth-basic")).strip()
+        self.github_auth_header = "Basic %s" % base64.encodestring("%s" % self.git_token).strip()
+        self.http_pool = HTTPConnectionPool(http_pool_size)
+        self.rate_limiter = RateLimiter()
+        self.output_lock = threading.Lock()
+        self.process_lock = threading.Lock()
+        self.commit_batch_size = commit_batch_size
+        self.commit_interval = commit_interval
+        self.shard_index = 0
+        self.shard_count = 1
+        self.shard_history = None
+        self.processes = set()
+        self.stopping = False
         self.testrail = None
         self.testrail_user = None
-        self.testrail_runs = {}
-        self.testrail_plans = {}
-        self.testrail_suites = {}
+        self.testrail_project = testrail_project
+        self.testrail_project_id = None
+        # The runs, plans and suites are only listed once used.
+        self.testrail_lock = threading.Lock()
+        self.testrail_listings = {"runs": {}, "plans": {}, "suites": {}}
         if testrail_token:
             if ':' in testrail_token:
                 (testrail_email, testrail_api_key) = testrail_token.split(':')
-            self.testrail = testrail.APIClient(testrail_server)
+            self.testrail = testrail.APIClient(testrail_server, timeout=testrail_timeout)
             self.testrail.user = testrail_email
             self.testrail.password = testrail_api_key
             try:
@@ -269,19 +1130,9 @@ class SeleniumSandbox:
                     raise TestRailInternalServerError("Internal server error for TestRail")
                 else:
                     raise TestRailError("Unhandled server error %s" % e.code)
-            except urllib2.URLError:
+            except (socket.error, httplib.HTTPException):
                 raise TestRailServerNotFound("TestRail server not found. Enable VPN or use on the Autodesk Network.")
-
-            self.testrail_project_id = None
-            for project in self.testrail.send_get('get_projects'):
-                if project['name'] == testrail_project:
-                    self.testrail_project_id = project['id']
-                    break
-            if self.testrail_project_id is None:
-                raise TestRailShotgunProjectNotFound('Project %s cannot be found on TestRail' % testrail_project)
-            self.testrail_runs = self.get_testrail_runs()
-            self.testrail_plans = self.get_testrail_plans()
-            self.testrail_suites = self.get_testrail_suites()
+            self.testrail_listings = {}
         self.debugging = debugging
         self.available_cases = {}
         self.available_suites = {}
@@ -289,12 +1140,38 @@ class SeleniumSandbox:
         self.target_version_name = None
         self.target_version_hash = None
         self.shotgun_version = None
-        self.github_user = self.get_elems("https://api.github.com/user")
+        self.work_folder = None
+        # Setting the work folder first lets the GitHub user lookup be
+        # answered from the HTTP cache.
+        if work_folder is not None:
+            self.set_work_folder(work_folder)
+        self.github_user = self.get_elems("%s/user" % self.github_url)
 
     def update_targets(self):
         """
         Update tartgets.
-        """
+
+        The targets are read from the discovery index of the tree the work
+        folder was synchronized with, which is built from the tree objects
+        when missing. The work folder is only walked when it was never
+        synchronized.
+        """
+        index = None
+        sha = self.get_synced_tree()
+        if sha is not None:
+            index = self.load_targets_index(sha)
+            if index is None and self.has_git_object(sha):
+                index = self.build_targets_index(sha)
+                self.save_targets_index(index)
+        if index is not None:
+            self.available_suites = {}
+            for key in index["suites"]:
+                self.available_suites[key] = os.path.join(self.work_folder, key, self.command_file)
+            self.available_cases = {}
+            for (case_id, key) in index["cases"].items():
+                self.available_cases[int(case_id)] = os.path.join(self.work_folder, key)
+            return
+
         self.available_suites = {}
         for target in locate_files(self.command_file, os.path.join(self.work_folder, 'suites')):
             key = target[len(self.work_folder) + 1:]
@@ -308,6 +1185,61 @@ class SeleniumSandbox:
                 case_id = int(case_id.lstrip('C'))
                 self.available_cases[case_id] = target
 
+    def get_targets_index_file(self):
+        """
+        Get targets index file.
+        """
+        return self.git_folder + os.path.sep + "targets.json"
+
+    def load_targets_index(self, sha):
+        """
+        Load the discovery index of the targets of a tree, or None.
+        """
+        index_file = self.get_targets_index_file()
+        if not os.path.exists(index_file):
+            return None
+        try:
+            with open(index_file) as data_file:
+                index = json.load(data_file)
+        except ValueError:
+            return None
+        if index.get("version") != 1 or index.get("tree") != sha:
+            return None
+        return index
+
+    def build_targets_index(self, sha):
+        """
+        Build the discovery index of the targets of a tree.
+
+        Suites are the folders of suites/ holding a runTest.command file,
+        and cases the suites named C<case id>. Only the tree objects are
+        read, the work folder is not looked at.
+        """
+        index = {"version": 1, "tree": sha, "suites": [], "cases": {}}
+        folders = [(elem["sha"], elem["path"]) for elem in self.get_tree(sha)["tree"] if elem["path"] == "suites" and elem["type"] == "tree"]
+        while folders:
+            (folder_sha, path) = folders.pop()
+            for elem in self.get_tree(folder_sha)["tree"]:
+                if elem["type"] == "tree":
+                    folders.append((elem["sha"], path + "/" + elem["path"]))
+                elif elem["path"] == self.command_file:
+                    index["suites"].append(path)
+                    name = path.rpartition("/")[2]
+                    if re.match("^C[0-9]+$", name):
+                        index["cases"][str(int(name.lstrip("C")))] = path
+        index["suites"].sort()
+        return index
+
+    def save_targets_index(self, index):
+        """
+        Save the discovery index of the targets.
+        """
+        (fd, temp_file) = tempfile.mkstemp(prefix="tmp_targets_", dir=self.git_folder)
+        with os.fdopen(fd, "w") as data_file:
+            json.dump(index, data_file, sort_keys=True)
+        os.chmod(temp_file, 0644)
+        os.rename(temp_file, self.get_targets_index_file())
+
     def set_work_folder(self, work_folder):
         """
         Set work folder.
@@ -318,6 +1250,7 @@ class SeleniumSandbox:
         self.git_folder = work_folder + os.path.sep + ".git"
         self.git_objects_folder = self.git_folder + os.path.sep + "objects"
         self.git_refs_folder = self.git_folder + os.path.sep + "refs"
+        self.http_cache_folder = self.git_folder + os.path.sep + "http-cache"
 
         if not os.path.exists(self.git_objects_folder):
             os.makedirs(self.git_objects_folder)
@@ -327,6 +1260,17 @@ class SeleniumSandbox:
         if not os.path.exists(self.git_refs_folder):
             os.makedirs(self.git_refs_folder)
 
+        if not os.path.exists(self.http_cache_folder):
+            os.makedirs(self.http_cache_folder)
+
+        shared_store = None
+        if self.shared_objects_folder:
+            if not os.path.exists(self.shared_objects_folder):
+                os.makedirs(self.shared_objects_folder)
+            shared_store = objectStore.ObjectStore(self.shared_objects_folder, self.compress_objects)
+        self.object_store = objectStore.ObjectStore(self.git_objects_folder, self.compress_objects, shared_store)
+        self.duration_history = DurationHistory(self.git_folder + os.path.sep + "durations.json")
+
     def get_work_folder(self):
         """
         Get work folder.
@@ -354,6 +1298,68 @@ class SeleniumSandbox:
         """
         return self.testrail is not None
 
+    def load_testrail_listings(self):
+        """
+        List the TestRail runs, plans and suites of the project.
+
+        The project is looked up first, then the listings not loaded yet
+        are fetched concurrently.
+        """
+        with self.testrail_lock:
+            missing = [name for name in ("runs", "plans", "suites") if name not in self.testrail_listings]
+            if not missing:
+                return
+            if self.testrail_project_id is None:
+                for project in self.testrail.send_get('get_projects'):
+                    if project['name'] == self.testrail_project:
+                        self.testrail_project_id = project['id']
+                        break
+                if self.testrail_project_id is None:
+                    raise TestRailShotgunProjectNotFound('Project %s cannot be found on TestRail' % self.testrail_project)
+            loaders = {
+                "runs": self.get_testrail_runs,
+                "plans": self.get_testrail_plans,
+                "suites": self.get_testrail_suites
+            }
+            listings = {}
+
+            def load(name):
+                listings[name] = loaders[name]()
+
+            pool = WorkerPool(len(missing))
+            for name in missing:
+                pool.submit(load, name)
+            pool.join()
+            self.testrail_listings.update(listings)
+
+    def get_testrail_listing(self, name):
+        """
+        Get a TestRail listing, loading the listings on first use.
+        """
+        if name not in self.testrail_listings:
+            self.load_testrail_listings()
+        return self.testrail_listings[name]
+
+    def set_testrail_listing(self, name, value):
+        """
+        Set a TestRail listing.
+        """
+        with self.testrail_lock:
+            self.testrail_listings[name] = value
+
+    testrail_runs = property(
+        lambda self: self.get_testrail_listing("runs"),
+        lambda self, value: self.set_testrail_listing("runs", value)
+    )
+    testrail_plans = property(
+        lambda self: self.get_testrail_listing("plans"),
+        lambda self, value: self.set_testrail_listing("plans", value)
+    )
+    testrail_suites = property(
+        lambda self: self.get_testrail_listing("suites"),
+        lambda self, value: self.set_testrail_listing("suites", value)
+    )
+
     def get_testrail_runs(self):
         """
         Get TestRail runs.
@@ -389,7 +1395,7 @@ class SeleniumSandbox:
         Get target version.
         """
         self.target_url = target_url
-        (self.target_version_name, self.target_version_hash) = get_site_version(target_url)
+        (self.target_version_name, self.target_version_hash) = get_site_version(target_url, self.http_pool)
         self.shotgun_version = self.get_tree(self.target_version_hash)["sha"]
 
     def fetch_shotgun_files(self, target_url):
@@ -401,72 +1407,244 @@ class SeleniumSandbox:
         head_file.write("%s\n" % self.shotgun_version)
         head_file.close()
 
-        self.fetch_tree(self.find_tree(self.shotgun_version, "test/selenium"))
+        sha = self.find_tree(self.shotgun_version, "test/selenium")
+        # The archive only pays off on a cold cache, when the tree has never
+        # been fetched. Otherwise only the changed blobs are downloaded.
+        if self.fetch_mode == "archive" and not self.has_git_object(sha):
+            self.fetch_archive(self.target_version_hash, "test/selenium")
+        self.fetch_tree(sha)
         print(".")
 
+    def fetch_archive(self, ref, path):
+        """
+        Fetch archive.
+
+        Downloads the tarball of the commit ref and stores every file found
+        under path as a blob object, named after its git SHA-1. The tarball
+        is extracted while it is streamed and never written to disk.
+        fetch_tree is then left with listing the trees of path and
+        downloading the blobs missing from the archive, if any.
+        """
+        prefix = path.strip("/") + "/"
+        count = 0
+        response = self.open_github_url("%s/tarball/%s" % (self.github_repo_url, ref))
+        try:
+            archive = tarfile.open(fileobj=response, mode="r|*")
+            for member in archive:
+                # Archive entries are all located under a <owner>-<repo>-<ref> folder.
+                name = member.name.partition("/")[2]
+                if not name.startswith(prefix):
+                    continue
+                if member.isfile():
+                    data = archive.extractfile(member).read()
+                elif member.issym():
+                    data = member.linkname
+                else:
+                    continue
+                blob_sha = hashlib.sha1("blob %d\0%s" % (len(data), data)).hexdigest()
+                if not self.has_git_object(blob_sha):
+                    blob_file = self.write_git_object(blob_sha, lambda data_file: data_file.write(data))
+                    count += 1
+                    if self.debugging:
+                        print("DEBUG: Extracting blob %s" % blob_file)
+            archive.close()
+        except (tarfile.TarError, IOError, httplib.HTTPException) as e:
+            raise GitHubError("GitHub archive of %s could not be extracted: %s\n" % (ref, e))
+        finally:
+            response.close()
+
+        if self.debugging:
+            print("DEBUG: Extracted %d blobs from the archive of %s" % (count, ref))
+
+    def get_connection_stats(self):
+        """
+        Get connection stats.
+        """
+        return self.http_pool.stats()
+
+    def open_github_url(self, url, headers=None):
+        """
+        Open GitHub URL.
+
+        Requests are scheduled by the rate limiter, and retried when GitHub
+        rejects them because of a rate limit.
+        """
+        headers = dict(headers or {})
+        headers["Authorization"] = self.github_auth_header
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                response = self.http_pool.urlopen(url, headers)
+            except urllib2.HTTPError as e:
+                self.rate_limiter.update(e.hdrs)
+                wait = self.rate_limiter.retry_delay(e, attempt)
+                if wait is None:
+                    raise GitHubError("GitHub Unexpected exception: %s\n" % e)
+                if attempt >= self.rate_limiter.max_retries or wait > self.rate_limiter.max_wait:
+                    raise GitHubRateLimitExceeded("GitHub rate limit exceeded for %s: %s\n" % (url, e))
+                with self.output_lock:
+                    print("WARNING: GitHub rate limit reached, retrying in %d seconds" % wait)
+                self.rate_limiter.hold(wait)
+                attempt += 1
+                continue
+            except Exception as e:
+                self.rate_limiter.update(None)
+                raise GitHubError("GitHub Unexpected exception: %s\n" % e)
+            self.rate_limiter.update(response.info())
+            return response
+
+    def get_http_cache_file(self, url):
+        """
+        Get HTTP cache file.
+
+        Returns None for the URLs that must not be cached: git objects are
+        content-addressed and already stored in the objects folder.
+        """
+        if self.work_folder is None or re.search("/git/(trees|blobs)/[0-9a-f]+", url):
+            return None
+        # Responses depend on who is asking, e.g. for the user lookup.
+        key = hashlib.sha1("%s\n%s" % (self.github_auth_header, url)).hexdigest()
+        return self.http_cache_folder + os.path.sep + key
+
     def get_elems(self, url):
         """
         Get elems from GitHub.
+
+        Lookups that are not content-addressed are sent as conditional
+        requests, and answered from the HTTP cache when GitHub replies 304
+        Not Modified. Such replies do not count against the rate limit.
         """
-        # base64string = base64.encodestring("%s:%s" % (self.git_token, "x-oauth-basic")).strip()
-        base64string = base64.encodestring("%s" % self.git_token).strip()
-        authheader = "Basic %s" % base64string
+        cache_file = self.get_http_cache_file(url)
+        cached = None
+        headers = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as data_file:
+                    cached = json.load(data_file)
+                if cached.get("etag"):
+                    headers["If-None-Match"] = cached["etag"]
+                if cached.get("last_modified"):
+                    headers["If-Modified-Since"] = cached["last_modified"]
+            except ValueError:
+                cached = None
+
         results = {}
         try:
-            request = urllib2.Request(url)
-            request.add_header("Authorization", authheader)
-            response = urllib2.urlopen(request)
-            results = json.loads(response.read())
+            response = self.open_github_url(url, headers)
+            try:
+                body = response.read()
+            finally:
+                response.close()
+            if response.getcode() == 304 and cached is not None:
+                body = cached["body"]
+                if self.debugging:
+                    print("DEBUG: GitHub API %s not modified" % url)
+            elif cache_file is not None:
+                etag = response.info().getheader("ETag")
+                last_modified = response.info().getheader("Last-Modified")
+                if etag or last_modified:
+                    self.write_http_cache_file(cache_file, {"url": url, "etag": etag, "last_modified": last_modified, "body": body})
+            results = json.loads(body)
             if self.debugging:
                 print("DEBUG: GitHub API X-RateLimit-Remaining: %s" % response.info().getheader("X-RateLimit-Remaining"))
+        except GitHubError:
+            raise
         except Exception as e:
             raise GitHubError("GitHub Unexpected exception: %s\n" % e)
         return results
 
+    def write_http_cache_file(self, cache_file, entry):
+        """
+        Write HTTP cache file.
+        """
+        (fd, temp_file) = tempfile.mkstemp(prefix="tmp_", dir=self.http_cache_folder)
+        with os.fdopen(fd, "w") as data_file:
+            json.dump(entry, data_file)
+        os.rename(temp_file, cache_file)
+
     def get_git_object_folder(self, sha):
         """
         Get git object folder.
         """
-        return self.git_objects_folder + os.path.sep + sha[:2]
+        return self.object_store.get_folder(sha)
 
     def get_git_object_file(self, sha):
         """
         Get git object file.
         """
-        return self.get_git_object_folder(sha) + os.path.sep + sha[2:]
+        return self.object_store.get_file(sha)
 
     def has_git_object(self, sha):
         """
         Get git object.
         """
-        return len(glob.glob(self.get_git_object_file(sha) + "*")) == 1
+        return self.object_store.contains(sha)
+
+    def write_git_object(self, sha, write, kind="blob"):
+        """
+        Write git object.
+        """
+        return self.object_store.write(sha, write, kind)
 
     def get_tree(self, sha):
         """
         Get tree.
         """
-        if self.has_git_object(sha):
-            tree_file = glob.glob(self.get_git_object_file(sha) + "*")[0]
-            json_file = os.fdopen(os.open(tree_file, os.O_RDONLY))
-            elems = json.load(json_file)
+        full_sha = self.object_store.find(sha)
+        if full_sha is not None:
+            elems = json.loads(self.object_store.read(full_sha))
         else:
-            elems = self.get_elems("https://api.github.com/repos/shotgunsoftware/shotgun/git/trees/%s" % sha)
+            elems = self.get_elems("%s/git/trees/%s" % (self.github_repo_url, sha))
             if elems["truncated"]:
                 raise GitError("Items in folder too high to use the GitHub API. No workaround yet... other than local cloning.")
 
-            tree_file = self.get_git_object_file(elems["sha"])
-            tree_file_folder = self.get_git_object_folder(elems["sha"])
+            tree_file = self.write_git_object(elems["sha"], lambda data_file: json.dump(elems, data_file), "tree")
 
             if self.debugging:
                 print("DEBUG: Getting tree %s" % tree_file)
+        return elems
 
-            if not os.path.exists(tree_file_folder):
-                os.mkdir(tree_file_folder)
+    def get_tree_recursive(self, sha):
+        """
+        Get tree recursively.
 
-            data_file = os.fdopen(os.open(tree_file, os.O_WRONLY | os.O_CREAT, 0644), "w")
-            json.dump(elems, data_file)
-            data_file.close()
-        return elems
+        Lists the whole tree with a single GitHub call and stores every
+        sub-tree as its own object, in the same format get_tree uses.
+        Returns False when GitHub truncated the listing, in which case
+        nothing is stored and the caller has to walk the tree.
+        """
+        elems = self.get_elems("%s/git/trees/%s?recursive=1" % (self.github_repo_url, sha))
+        if elems["truncated"]:
+            if self.debugging:
+                print("DEBUG: Recursive listing of tree %s truncated, walking the tree instead" % sha)
+            return False
+
+        trees = {}
+
+        def tree_at(path):
+            return trees.setdefault(path, {"sha": None, "url": None, "tree": [], "truncated": False})
+
+        root = tree_at("")
+        root["sha"] = elems["sha"]
+        root["url"] = elems["url"]
+        for elem in elems["tree"]:
+            (parent, sep, name) = elem["path"].rpartition("/")
+            entry = dict(elem)
+            entry["path"] = name
+            tree_at(parent)["tree"].append(entry)
+            if elem["type"] == "tree":
+                tree = tree_at(elem["path"])
+                tree["sha"] = elem["sha"]
+                tree["url"] = elem["url"]
+
+        for path in sorted(trees.keys()):
+            tree = trees[path]
+            if not self.has_git_object(tree["sha"]):
+                tree_file = self.write_git_object(tree["sha"], lambda data_file: json.dump(tree, data_file), "tree")
+                if self.debugging:
+                    print("DEBUG: Getting tree %s" % tree_file)
+        return True
 
     def get_blob(self, elem):
         """
@@ -476,25 +1654,18 @@ class SeleniumSandbox:
             pass
         else:
             mode = elem["mode"]
+            if mode[:2] != "10" and mode[:2] != "12":  # File or symlink
+                raise Exception("Unable to process %s, do not know how to handle mode %s." % (self.get_git_object_file(elem["sha"]), mode))
+
             blob = self.get_elems(elem["url"])
             data = base64.b64decode(blob["content"])
+            blob_file = self.write_git_object(elem["sha"], lambda data_file: data_file.write(data))
 
-            blob_file = self.get_git_object_file(elem["sha"])
-            blob_file_folder = self.get_git_object_folder(elem["sha"])
-
-            if self.debugging:
-                print("DEBUG: Getting blob %s" % blob_file)
-            else:
-                print ".",
-
-            if not os.path.exists(blob_file_folder):
-                os.mkdir(blob_file_folder)
-            if mode[:2] == "10" or mode[:2] == "12":  # File or symlink
-                data_file = os.fdopen(os.open(blob_file, os.O_WRONLY | os.O_CREAT, 0644), "w")
-                data_file.write(data)
-                data_file.close()
-            else:
-                raise Exception("Unable to process %s, do not know how to handle mode %s." % (blob_file, mode))
+            with self.output_lock:
+                if self.debugging:
+                    print("DEBUG: Getting blob %s" % blob_file)
+                else:
+                    print ".",
 
     def find_tree(self, sha, path):
         """
@@ -510,91 +1681,270 @@ class SeleniumSandbox:
                 raise Exception("Path to %s not found")
         return sha
 
-    def fetch_tree(self, sha):
+    def fetch_tree(self, sha, pool=None):
         """
-        Getch tree.
+        Fetch tree.
+
+        Trees are listed by the calling thread while the blobs are
+        downloaded in the background by a pool of fetch_workers threads.
+        Unless the fetch mode is walk, all the missing trees are first listed
+        with a single GitHub call.
         """
+        if pool is None:
+            if self.fetch_mode != "walk" and not self.has_git_object(sha):
+                self.get_tree_recursive(sha)
+            pool = WorkerPool(self.fetch_workers)
+            try:
+                self.fetch_tree(sha, pool)
+            except BaseException:
+                pool.cancel()
+                raise
+            finally:
+                pool.join()
+            if self.debugging:
+                print("DEBUG: Fetched %d blobs with %d workers" % (pool.completed, pool.workers))
+            return
+
         tree = self.get_tree(sha)
 
         for elem in tree["tree"]:
             if elem["type"] == "tree":
-                self.fetch_tree(elem["sha"])
+                self.fetch_tree(elem["sha"], pool)
             elif elem["type"] == "blob":
-                self.get_blob(elem)
+                if not self.has_git_object(elem["sha"]):
+                    pool.submit(self.get_blob, elem)
             else:
                 raise Exception("Do not know how to handle object type %s for object %s" % (elem["type"], elem["path"]))
 
-    def sync_filesystem(self, sha=None, prefix=None):
+    def get_synced_tree(self):
+        """
+        Get the SHA-1 of the tree the work folder was last synchronized with.
+        """
+        sync_head = self.git_folder + os.path.sep + "SYNC_HEAD"
+        if os.path.exists(sync_head):
+            with open(sync_head) as head_file:
+                return head_file.read().strip() or None
+        return None
+
+    def set_synced_tree(self, sha):
+        """
+        Set the SHA-1 of the tree the work folder was synchronized with.
+        """
+        (fd, temp_file) = tempfile.mkstemp(prefix="tmp_head_", dir=self.git_folder)
+        with os.fdopen(fd, "w") as head_file:
+            head_file.write("%s\n" % sha)
+        os.rename(temp_file, self.git_folder + os.path.sep + "SYNC_HEAD")
+
+        # The log of the synchronized trees tells which objects to keep
+        # when collecting garbage.
+        if get_synced_trees(self.git_folder, 1) != [sha]:
+            logs_folder = self.git_folder + os.path.sep + "logs"
+            if not os.path.exists(logs_folder):
+                os.makedirs(logs_folder)
+            with open(logs_folder + os.path.sep + "SYNC_HEAD", "a") as log_file:
+                log_file.write("%s %d\n" % (sha, time.time()))
+
+    def remove_path(self, obj):
+        """
+        Remove a file or folder from the work folder, unless protected.
+
+        Returns the message to report, if any.
+        """
+        if os.path.islink(obj):
+            os.remove(obj)
+            return "Removing symlink: %s" % obj
+        # Do not delete the build folder
+        elif os.path.isdir(obj):
+            if os.path.join(self.work_folder, "build") != obj:
+                shutil.rmtree(obj)
+                self.stat_cache.remove(obj[len(self.work_folder) + 1:])
+                return "Removing folder: %s" % obj
+        # do not delete the config.xml file
+        elif os.path.join(self.work_folder, "suites", "config", "config.xml") != obj:
+            os.remove(obj)
+            self.stat_cache.remove(obj[len(self.work_folder) + 1:])
+            return "Removing file: %s" % obj
+        return None
+
+    def sync_blob(self, elem, path):
+        """
+        Sync a blob of a tree with a file of the work folder.
+
+        Returns the message to report, if any.
+        """
+        sha = elem["sha"]
+        mode = elem["mode"][:2]
+        perm = int(elem["mode"][2:], 8)
+        if mode == "10":
+            key = path[len(self.work_folder) + 1:]
+            if os.path.exists(path):
+                stat_info = os.stat(path)
+                file_sha1 = self.stat_cache.lookup(key, stat_info)
+                if file_sha1 is None:
+                    with open(path, "rb") as data_file:
+                        file_sha1 = hashlib.sha1("blob " + str(stat_info.st_size) + "\0" + data_file.read()).hexdigest()
+                    self.stat_cache.update(key, stat_info, file_sha1)
+                # A mode change keeps the SHA-1. The file is checked out
+                # again rather than chmod'ed, as it may be a hardlink.
+                if file_sha1 != sha or (stat_info.st_mode & 0111) != (perm & 0111):
+                    self.checkout_blob(sha, path, perm)
+                    self.stat_cache.update(key, os.stat(path), sha)
+                    return "updating file: " + path
+            else:
+                self.checkout_blob(sha, path, perm)
+                self.stat_cache.update(key, os.stat(path), sha)
+                return "creating file: " + path
+        elif mode == "12":
+            if not os.path.exists(path):
+                lines = [line.strip() for line in self.object_store.read(sha).splitlines()]
+                os.symlink(lines[0], path)
+                return "creating symlink: " + path
+        else:
+            raise Exception("Unable to process %s, do not know how to handle mode %s." % (path, mode))
+        return None
+
+    def checkout_blob(self, sha, path, perm):
         """
-        Sync filesystem.
+        Write a blob to a file of the work folder.
         """
-        update_targets = False
-        if sha is None:
-            sha = self.find_tree(self.shotgun_version, "test/selenium")
-            update_targets = True
+        how = self.object_store.checkout(sha, path, perm, self.checkout_mode == "link")
+        with self.output_lock:
+            self.checkout_stats[how] += 1
 
+    def get_checkout_stats(self):
+        """
+        Get checkout stats.
+        """
+        return dict(self.checkout_stats)
+
+    def sync_filesystem(self, full=False):
+        """
+        Sync filesystem.
+
+        When the work folder was synchronized before, only the differences
+        between the tree it was synchronized with and the target tree are
+        applied, unless full is set.
+        """
+        sha = self.find_tree(self.shotgun_version, "test/selenium")
+        self.stat_cache = StatCache(self.git_folder + os.path.sep + "index.json")
+        synced_sha = self.get_synced_tree()
+        plan = []
+        full = full or synced_sha is None or not self.has_git_object(synced_sha)
+        if full:
+            self.plan_sync(sha, self.work_folder + os.path.sep, plan)
+        elif synced_sha != sha:
+            self.plan_sync_diff(synced_sha, sha, self.work_folder + os.path.sep, plan)
+        self.apply_sync(plan)
+        self.stat_cache.save(prune=full)
+        self.set_synced_tree(sha)
+        self.update_targets()
+
+    def apply_sync(self, plan):
+        """
+        Apply the operations planned to sync the work folder.
+
+        Removals and folder creations are applied in order first. Files are
+        then hashed and written by a pool of sync_workers threads, so that
+        the latency of network filesystems overlaps. Messages are reported
+        in the order of the plan.
+        """
+        messages = [None] * len(plan)
+        blobs = []
+        for (i, (operation, path, elem)) in enumerate(plan):
+            if operation == "remove":
+                messages[i] = self.remove_path(path)
+            elif operation == "mkdir":
+                os.mkdir(path)
+                messages[i] = "creating folder: " + path
+            else:
+                blobs.append(i)
+
+        def sync(i):
+            (operation, path, elem) = plan[i]
+            messages[i] = self.sync_blob(elem, path)
+
+        pool = WorkerPool(self.sync_workers)
+        try:
+            for i in blobs:
+                pool.submit(sync, i)
+        except BaseException:
+            pool.cancel()
+            raise
+        finally:
+            pool.join()
+            for message in messages:
+                if message is not None:
+                    print(message)
+
+    def plan_sync(self, sha, prefix, plan):
+        """
+        Plan the operations to sync a folder with a tree.
+        """
         tree = self.get_tree(sha)
 
-        prefix = prefix or self.work_folder + os.path.sep
         expected = [x['path'] for x in tree["tree"]]
         # We want to avoir deleting our .git folder.
         expected.append(".git")
 
-        actual = os.listdir(prefix)
+        actual = []
+        if os.path.isdir(prefix):
+            actual = sorted(os.listdir(prefix))
 
         # Cleanup any extra files or folders
         diff = [x for x in actual if x not in expected]
         for i in diff:
-            obj = prefix + i
-            if os.path.islink(obj):
-                print("Removing symlink: %s" % obj)
-                os.remove(obj)
-            # Do not delete the build folder
-            elif os.path.isdir(obj):
-                if os.path.join(self.work_folder, "build") != obj:
-                    print("Removing folder: %s" % obj)
-                    shutil.rmtree(obj)
-            # do not delete the config.xml file
-            elif os.path.join(self.work_folder, "suites", "config", "config.xml") != obj:
-                print("Removing file: %s" % obj)
-                os.remove(obj)
+            plan.append(("remove", prefix + i, None))
 
         # And now sync our files.
         for elem in tree["tree"]:
             path = prefix + elem["path"]
-            sha = elem["sha"]
             if elem["type"] == "tree":
                 if not os.path.exists(path):
-                    print("creating folder: " + path)
-                    os.mkdir(path)
-                self.sync_filesystem(sha, path + os.path.sep)
+                    plan.append(("mkdir", path, None))
+                self.plan_sync(elem["sha"], path + os.path.sep, plan)
             elif elem["type"] == "blob":
-                mode = elem["mode"][:2]
-                perm = int(elem["mode"][2:], 8)
-                if mode == "10":
-                    if os.path.exists(path):
-                        stat_info = os.stat(path)
-                        file_sha1 = hashlib.sha1("blob " + str(stat_info.st_size) + "\0" + open(path, "rb").read()).hexdigest()
-                        if file_sha1 != sha:
-                            print("updating file: " + path)
-                            shutil.copy(self.get_git_object_file(sha), path)
-                            os.chmod(path, perm)
-                    else:
-                        print("creating file: " + path)
-                        shutil.copy(self.get_git_object_file(sha), path)
-                        os.chmod(path, perm)
-                elif mode == "12":
-                    if not os.path.exists(path):
-                        print("creating symlink: " + path)
-                        lines = [line.strip() for line in open(self.get_git_object_file(sha))]
-                        os.symlink(lines[0], path)
-                    pass
+                plan.append(("blob", path, elem))
+            else:
+                raise Exception("Do not know how to handle object type %s for object %s" % (elem["type"], elem["path"]))
+
+    def plan_sync_diff(self, old_sha, new_sha, prefix, plan):
+        """
+        Plan the operations to sync the differences between two trees.
+
+        Entries with the same SHA-1 and mode in both trees are skipped, so
+        that unchanged sub-trees are never listed.
+        """
+        old_tree = dict((x["path"], x) for x in self.get_tree(old_sha)["tree"])
+        new_tree = self.get_tree(new_sha)
+
+        expected = set(x["path"] for x in new_tree["tree"])
+        for name in sorted(old_tree.keys()):
+            if name not in expected and os.path.lexists(prefix + name):
+                plan.append(("remove", prefix + name, None))
+
+        for elem in new_tree["tree"]:
+            path = prefix + elem["path"]
+            old_elem = old_tree.get(elem["path"])
+            if old_elem is not None and old_elem["sha"] == elem["sha"] and old_elem["mode"] == elem["mode"]:
+                continue
+            if elem["type"] == "tree":
+                if old_elem is not None and old_elem["type"] == "tree" and os.path.isdir(path):
+                    self.plan_sync_diff(old_elem["sha"], elem["sha"], path + os.path.sep, plan)
                 else:
-                    raise Exception("Unable to process %s, do not know how to handle mode %s." % (path, mode))
+                    if os.path.lexists(path) and not os.path.isdir(path):
+                        plan.append(("remove", path, None))
+                    if not os.path.isdir(path) or os.path.islink(path):
+                        plan.append(("mkdir", path, None))
+                    self.plan_sync(elem["sha"], path + os.path.sep, plan)
+            elif elem["type"] == "blob":
+                if os.path.islink(path) or os.path.isdir(path):
+                    plan.append(("remove", path, None))
+                elif old_elem is not None and old_elem["mode"][:2] != elem["mode"][:2]:
+                    # A symlink replaced by a file or the other way around.
+                    plan.append(("remove", path, None))
+                plan.append(("blob", path, elem))
             else:
                 raise Exception("Do not know how to handle object type %s for object %s" % (elem["type"], elem["path"]))
-        if update_targets:
-            self.update_targets()
 
     def generate_config(self, options):
         """
@@ -633,10 +1983,190 @@ class SeleniumSandbox:
         """
         return test_suite in self.available_suites
 
-    def execute_suite(self, test_suite):
+    def start_process(self, args, **kwargs):
+        """
+        Start a process in its own process group.
+
+        Returns None once the processes are being stopped.
+        """
+        with self.process_lock:
+            if self.stopping:
+                return None
+            process = subprocess.Popen(args, preexec_fn=os.setsid, **kwargs)
+            self.processes.add(process)
+            return process
+
+    def end_process(self, process):
+        """
+        Forget a process that has ended.
+        """
+        with self.process_lock:
+            self.processes.discard(process)
+
+    def kill_processes(self):
+        """
+        Kill the process group of every running process, and start no more.
+        """
+        with self.process_lock:
+            self.stopping = True
+            for process in self.processes:
+                try:
+                    os.killpg(process.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+
+    def set_shard(self, shard_index, shard_count, history=None):
+        """
+        Set the shard of the TestRail tests run by this sandbox, weighted
+        by the durations of a history when given.
+
+        That history has to be the same on every agent, and is only read:
+        the durations of the cases run are recorded in the duration history
+        of the sandbox, which differs between agents.
+        """
+        self.shard_index = shard_index
+        self.shard_count = shard_count
+        self.shard_history = history
+
+    def get_shard_cases(self, case_ids):
+        """
+        Get the case IDs of this shard.
+
+        Cases are spread by a hash of their ID, or when weighted, by
+        assigning the longest case first to the shard with the least work,
+        from the history the shard was set with.
+        """
+        case_ids = sorted(set(case_ids))
+        if self.shard_count <= 1:
+            return set(case_ids)
+        if self.shard_history is None:
+            return set(x for x in case_ids if shard_of(x, self.shard_count) == self.shard_index)
+        (durations, unknown) = self.estimate_durations(case_ids, self.shard_history)
+        # The work and the number of cases of every shard, the latter
+        # breaking ties when durations are unknown.
+        shards = [(0, 0)] * self.shard_count
+        cases = set()
+        for case_id in sorted(case_ids, key=lambda x: (-durations[x], x)):
+            shard = shards.index(min(shards))
+            shards[shard] = (shards[shard][0] + durations[case_id], shards[shard][1] + 1)
+            if shard == self.shard_index:
+                cases.add(case_id)
+        return cases
+
+    def get_tree_entry(self, sha, path):
+        """
+        Get the SHA-1 of the entry at a path of a tree, or None.
+        """
+        for name in path.split("/"):
+            if sha is None:
+                return None
+            elems = [elem for elem in self.get_tree(sha)["tree"] if elem["path"] == name]
+            sha = elems[0]["sha"] if elems else None
+        return sha
+
+    def get_changed_paths(self, paths):
+        """
+        Get the paths of the work folder, among paths, which changed since
+        the previous tree it was synchronized with.
+
+        Every path changed when one of the shared folders did, or when there
+        is no previous tree.
+        """
+        trees = get_synced_trees(self.git_folder, 2)
+        if len(trees) < 2 or not self.has_git_object(trees[1]):
+            return set(paths)
+        (new_sha, old_sha) = trees
+        for folder in SeleniumSandbox.shared_folders:
+            if self.get_tree_entry(old_sha, folder) != self.get_tree_entry(new_sha, folder):
+                return set(paths)
+        return set(path for path in paths if self.get_tree_entry(old_sha, path) != self.get_tree_entry(new_sha, path))
+
+    def get_changed_cases(self, case_ids):
+        """
+        Get the cases, among case_ids, which changed since the previous tree
+        the work folder was synchronized with.
+        """
+        paths = dict((self.available_cases[case_id][len(self.work_folder) + 1:], case_id) for case_id in case_ids)
+        return set(paths[path] for path in self.get_changed_paths(paths.keys()))
+
+    def get_build_folder(self):
+        """
+        Get a new timestamped build folder for the target site.
+        """
+        netloc = ""
+        if self.target_url:
+            netloc = urlparse.urlparse(self.target_url).netloc
+
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%Hh%Mm%Ss")
+        if self.shard_count > 1:
+            # Shards run on one host must not share their build folder.
+            timestamp += "_shard%dof%d" % (self.shard_index + 1, self.shard_count)
+        build_folder = os.path.join(
+            self.get_work_folder(),
+            "build",
+            netloc,
+            timestamp)
+        if not os.path.exists(build_folder):
+            os.makedirs(build_folder)
+        return build_folder
+
+    def execute_suites(self, test_suites, jobs=1):
+        """
+        Execute suites, up to jobs of them at once.
+
+        Every suite writes its build files to its own sub-folder of a new
+        build folder, and its output is captured to the stdout.log and
+        stderr.log files of that sub-folder. Returns the exit code of every
+        suite.
+        """
+        build_folder = self.get_build_folder()
+        codes = {}
+
+        def run(test_suite):
+            suite_folder = os.path.join(build_folder, test_suite.replace("/", "_"))
+            if not os.path.exists(suite_folder):
+                os.makedirs(suite_folder)
+            with self.output_lock:
+                print("INFO: Running tests from %s" % test_suite)
+            code = self.execute_suite(test_suite, suite_folder)
+            codes[test_suite] = code
+            with self.output_lock:
+                print("INFO:     Tests from %s completed with code %d, output in %s" % (test_suite, code, suite_folder))
+
+        pool = WorkerPool(jobs)
+        try:
+            for test_suite in test_suites:
+                pool.submit(run, test_suite)
+            pool.join()
+        except BaseException:
+            # The threads of the running suites return once their process
+            # group is killed.
+            pool.cancel()
+            self.kill_processes()
+            raise
+        return codes
+
+    def execute_suite(self, test_suite, build_folder=None):
         """
         Execute suite.
+
+        When a build folder is given, the suite writes its build files there
+        and its output is captured to files of that folder.
         """
+        if build_folder is not None:
+            if not self.is_valid_suite(test_suite):
+                raise SuiteNotFound("Non existent test suite %s" % test_suite)
+            env = dict(os.environ)
+            env["BUILD_FOLDER"] = build_folder
+            with open(os.path.join(build_folder, "stdout.log"), "w") as stdout:
+                with open(os.path.join(build_folder, "stderr.log"), "w") as stderr:
+                    process = self.start_process(self.available_suites[test_suite], env=env, stdout=stdout, stderr=stderr)
+                    if process is None:
+                        return -1
+                    try:
+                        return process.wait()
+                    finally:
+                        self.end_process(process)
         if self.is_valid_suite(test_suite):
             code = -1
             self.subProc = subprocess.Popen(self.available_suites[test_suite], preexec_fn=os.setsid)
@@ -708,9 +2238,19 @@ class SeleniumSandbox:
             #     raise TestRailRunInvalid('TestRail run %s does not belong to project Shotgun' % testrail_run)
         return False
 
-    def execute_run(self, testrail_run, commit=False, run_all=False):
+    def execute_run(self, testrail_run, commit=False, run_all=False, jobs=1, changed_only=False):
         """
         Execute run.
+
+        With jobs above 1, up to jobs tests are run at once, each one in
+        its own sub-folder of the build folder, where its output is
+        captured. Only the tests of the shard set with set_shard() are run,
+        and with changed_only, only those whose case changed since the
+        previous synchronization; the others keep their TestRail result.
+        Returns the results, as an add_results_for_cases payload.
+
+        When committing, results are committed in the background as they
+        come, and journaled in the build folder.
         """
         results = {"results": []}
 
@@ -719,78 +2259,198 @@ class SeleniumSandbox:
 
         tests = {}
 
-        for test in self.testrail.send_get('get_tests/%s' % testrail_run):
-            if test['title'].startswith('[Automation] '):
-                if test['case_id'] not in self.available_cases:
-                    warning = "WARNING: skipping test: T%s - %s (C%s) as it is not present in this codebase/version" % (
-                        test['id'], test['title'], test['case_id']
-                    )
-                    print warning
-                    result = {
-                        'case_id': test['case_id'],
-                        'status_id': 4,  # 4 = Retest
-                        'comment': "from Automation on %s\n%s" % (self.target_url, warning),
-                        'custom_os': [SeleniumSandbox.testrail_os[platform.system()]],
-                        'custom_webbrowser': [SeleniumSandbox.testrail_browsers['Firefox']],
-                        'version': "v%s (build %s)" % (self.target_version_name, self.target_version_hash)
-                    }
-                    results['results'].append(result)
-                else:
-                    if run_all or test['status_id'] != 1:
-                        tests[test["id"]] = test
+        automated = [test for test in self.testrail.send_get('get_tests/%s' % testrail_run) if test['title'].startswith('[Automation] ')]
+        shard_cases = self.get_shard_cases(test['case_id'] for test in automated)
+        if self.shard_count > 1:
+            print("INFO: Running shard %d of %d: %d of %d tests" % (
+                self.shard_index + 1, self.shard_count, len([x for x in automated if x['case_id'] in shard_cases]), len(automated)
+            ))
 
-        netloc = ""
-        if self.target_url:
-            netloc = urlparse.urlparse(self.target_url).netloc
+        build_folder = self.get_build_folder()
+        committer = None
+        if commit:
+            committer = ResultCommitter(self.testrail, os.path.join(build_folder, "results.jsonl"), self.commit_batch_size, self.commit_interval)
 
-        build_folder = os.path.join(
-            self.get_work_folder(),
-            "build",
-            netloc,
-            datetime.datetime.now().strftime("%Y-%m-%d_%Hh%Mm%Ss"))
-        if not os.path.exists(build_folder):
-            os.makedirs(build_folder)
+        def record(result):
+            with self.output_lock:
+                results['results'].append(result)
+            if committer is not None:
+                committer.add(testrail_run, result)
 
-        for test in tests:
+        try:
+            for test in automated:
+                if test['case_id'] in shard_cases:
+                    if test['case_id'] not in self.available_cases:
+                        warning = "WARNING: skipping test: T%s - %s (C%s) as it is not present in this codebase/version" % (
+                            test['id'], test['title'], test['case_id']
+                        )
+                        print warning
+                        result = {
+                            'case_id': test['case_id'],
+                            'status_id': 4,  # 4 = Retest
+                            'comment': "from Automation on %s\n%s" % (self.target_url, warning),
+                            'custom_os': [SeleniumSandbox.testrail_os[platform.system()]],
+                            'custom_webbrowser': [SeleniumSandbox.testrail_browsers['Firefox']],
+                            'version': "v%s (build %s)" % (self.target_version_name, self.target_version_hash)
+                        }
+                        record(result)
+                    else:
+                        if run_all or test['status_id'] != 1:
+                            tests[test["id"]] = test
+
+            if changed_only:
+                changed = self.get_changed_cases(tests[test]['case_id'] for test in tests)
+                for test in sorted(tests.keys()):
+                    if tests[test]['case_id'] not in changed:
+                        print("INFO: skipping test: T%s - %s (C%s) as it did not change since the previous version" % (
+                            test, tests[test]['title'], tests[test]['case_id']
+                        ))
+                        del tests[test]
+
+            (order, estimate, unknown) = self.schedule_tests(tests, jobs)
+            if tests:
+                message = "INFO: Estimated run time of %d tests: %s" % (len(tests), format_duration(estimate))
+                if unknown:
+                    message += " (%d tests never ran, counted as the average)" % unknown
+                print(message)
+
+            if jobs > 1:
+                def run(test):
+                    case_folder = os.path.join(build_folder, "C%s" % tests[test]['case_id'])
+                    if not os.path.exists(case_folder):
+                        os.makedirs(case_folder)
+                    with self.output_lock:
+                        print("INFO: Running test T%s - %s" % (test, tests[test]['title']))
+                    record(self.execute_case(tests[test], case_folder, True))
+                    with self.output_lock:
+                        print("INFO:     Test T%s completed, output in %s" % (test, case_folder))
+
+                pool = WorkerPool(jobs)
+                try:
+                    for test in order:
+                        pool.submit(run, test)
+                    pool.join()
+                except BaseException:
+                    # The running tests are recorded as aborted once their
+                    # process group is killed, and committed with the others.
+                    pool.cancel()
+                    self.kill_processes()
+                    try:
+                        pool.join()
+                    except Exception:
+                        pass
+                    raise
+            else:
+                for test in order:
+                    record(self.execute_case(tests[test], build_folder))
+        finally:
+            self.duration_history.save()
+            if committer is not None:
+                uncommitted = committer.close()
+                if uncommitted:
+                    print("WARNING: %d results could not be committed to TestRail (%s), replay them with --replay-results %s" % (
+                        uncommitted, committer.error, committer.journal_file
+                    ))
+        return results
 
-            test_suite = self.available_cases[tests[test]['case_id']]
-            test_suite = os.path.join(test_suite, self.command_file)
+    def estimate_durations(self, case_ids, history=None):
+        """
+        Estimate the durations of cases from their history, by default the
+        duration history of the sandbox.
+
+        Cases without history count as the average of the others. Returns
+        the durations by case ID, and how many cases have no history.
+        """
+        if history is None:
+            history = self.duration_history
+        durations = {}
+        for case_id in case_ids:
+            durations[case_id] = history.estimate(case_id, self.target_version_name)
+        known = [x for x in durations.values() if x is not None]
+        average = sum(known) / len(known) if known else 0
+        unknown = len(durations) - len(known)
+        for case_id in durations:
+            if durations[case_id] is None:
+                durations[case_id] = average
+        return (durations, unknown)
+
+    def schedule_tests(self, tests, jobs=1):
+        """
+        Schedule tests, the longest first.
+
+        Starting the longest tests first keeps a long test from stretching
+        the end of a parallel run. Returns the order of the tests, the
+        estimated run time with jobs tests at once, and how many tests have
+        no duration history.
+        """
+        (case_durations, unknown) = self.estimate_durations(tests[test]['case_id'] for test in tests)
+        durations = dict((test, case_durations[tests[test]['case_id']]) for test in tests)
+
+        order = sorted(tests, key=lambda x: (-durations[x], x))
+        workers = [0] * max(1, jobs)
+        for test in order:
+            workers[workers.index(min(workers))] += durations[test]
+        return (order, max(workers), unknown)
+
+    def execute_case(self, test, build_folder, capture=False):
+        """
+        Execute the suite of a TestRail test, and return its result.
+
+        With capture set, the output of the suite is written to the
+        stdout.log and stderr.log files of the build folder.
+        """
+        test_suite = self.available_cases[test['case_id']]
+        test_suite = os.path.join(test_suite, self.command_file)
+
+        if not os.path.exists(test_suite):
+            raise SuiteNotFound("Non existent test suite %s" % test_suite)
 
-            if os.path.exists(test_suite):
-                start_time = time.time()
-                stop_time = None
-                self.subProc = subprocess.Popen(test_suite, env={"BUILD_FOLDER": build_folder}, preexec_fn=os.setsid)
-                code = -1
+        (stdout, stderr) = (None, None)
+        if capture:
+            stdout = open(os.path.join(build_folder, "stdout.log"), "w")
+            stderr = open(os.path.join(build_folder, "stderr.log"), "w")
+        start_time = time.time()
+        stop_time = None
+        code = -1
+        try:
+            process = self.start_process(test_suite, env={"BUILD_FOLDER": build_folder}, stdout=stdout, stderr=stderr)
+            if process is not None:
                 try:
-                    code = self.subProc.wait()
+                    code = process.wait()
                     stop_time = time.time()
                 except (KeyboardInterrupt, SystemExit):
-                    os.killpg(self.subProc.pid, signal.SIGTERM)
+                    os.killpg(process.pid, signal.SIGTERM)
                 except Exception:
-                    os.killpg(self.subProc.pid, signal.SIGTERM)
+                    os.killpg(process.pid, signal.SIGTERM)
                     raise
-                if code == 0 or code == 1 or code == -1:
-                    result = {
-                        'case_id': tests[test]['case_id'],
-                        'status_id': SeleniumSandbox.testrail_statuses[code],
-                        'comment': "from Automation on %s" % self.target_url,
-                        'custom_os': [SeleniumSandbox.testrail_os[platform.system()]],
-                        'custom_webbrowser': [SeleniumSandbox.testrail_browsers['Firefox']],
-                        'version': "v%s (build %s)" % (self.target_version_name, self.target_version_hash)
-                    }
-                    if code == 0 or code == 1:
-                        elapsed = int(stop_time - start_time + 0.5)
-                        if elapsed > 0:
-                            result['elapsed'] = '%ds' % elapsed
-                    if code == -1:
-                        result['comment'] += " **Test aborted by user**"
-                    results['results'].append(result)
-                else:
-                    raise Exception("Unexpected return code from Selenium: %d" % code)
-            else:
-                raise SuiteNotFound("Non existent test suite %s" % test_suite)
-        if commit and len(results['results']) > 0:
-            self.testrail.send_post('add_results_for_cases/%s' % testrail_run, results)
+                finally:
+                    self.end_process(process)
+        finally:
+            if capture:
+                stdout.close()
+                stderr.close()
+        if code < 0 and self.stopping:
+            # Killed along with the other running tests.
+            code = -1
+        if code == 0 or code == 1 or code == -1:
+            result = {
+                'case_id': test['case_id'],
+                'status_id': SeleniumSandbox.testrail_statuses[code],
+                'comment': "from Automation on %s" % self.target_url,
+                'custom_os': [SeleniumSandbox.testrail_os[platform.system()]],
+                'custom_webbrowser': [SeleniumSandbox.testrail_browsers['Firefox']],
+                'version': "v%s (build %s)" % (self.target_version_name, self.target_version_hash)
+            }
+            if code == 0 or code == 1:
+                self.duration_history.record(test['case_id'], self.target_version_name, stop_time - start_time)
+                elapsed = int(stop_time - start_time + 0.5)
+                if elapsed > 0:
+                    result['elapsed'] = '%ds' % elapsed
+            if code == -1:
+                result['comment'] += " **Test aborted by user**"
+            return result
+        else:
+            raise Exception("Unexpected return code from Selenium: %d" % code)
 
     def signal_handler(self, sig, frm):
         """
@@ -828,6 +2488,72 @@ def main(argv):
         "--suites",
         help="Comma-separated list of path to Test suites to execute (OPTIONAL)"
     )
+    parser.add_option(
+        "--jobs",
+        type="int",
+        default=1,
+        help="Number of test suites or TestRail tests run at once, each one with its output captured in its build folder (OPTIONAL, defaults to 1)"
+    )
+    parser.add_option(
+        "--changed-only",
+        action="store_true",
+        dest="changed_only",
+        default=False,
+        help="Only run the suites or TestRail tests which changed since the previous version synchronized, the others being skipped (OPTIONAL)"
+    )
+    parser.add_option(
+        "--testrail-timeout",
+        type="int",
+        default=60,
+        help="Seconds after which a TestRail request times out (OPTIONAL, defaults to 60)"
+    )
+    parser.add_option(
+        "--commit-batch-size",
+        type="int",
+        default=20,
+        help="Number of TestRail results committed at once, as the tests run (OPTIONAL, defaults to 20)"
+    )
+    parser.add_option(
+        "--commit-interval",
+        type="int",
+        default=60,
+        help="Seconds after which the TestRail results waiting are committed, even if fewer than the batch size (OPTIONAL, defaults to 60)"
+    )
+    parser.add_option(
+        "--shard-index",
+        type="int",
+        default=0,
+        help="Index of the shard of the TestRail tests to run, from 0 (OPTIONAL, defaults to 0)"
+    )
+    parser.add_option(
+        "--shard-count",
+        type="int",
+        default=1,
+        help="Number of shards the TestRail tests are split in, to run them on several agents (OPTIONAL, defaults to 1)"
+    )
+    parser.add_option(
+        "--shard-weighted",
+        action="store_true",
+        dest="shard_weighted",
+        default=False,
+        help="Balance the shards with the --duration-history file, which has to be the same for every shard, and is only read (OPTIONAL)"
+    )
+    parser.add_option(
+        "--duration-history",
+        help="File of the duration history of the tests, unless shards are weighted with it (OPTIONAL, defaults to .git/durations.json in the work folder)"
+    )
+    parser.add_option(
+        "--results-file",
+        help="File the TestRail results are saved to, by run (OPTIONAL)"
+    )
+    parser.add_option(
+        "--merge-results",
+        help="Comma-separated list of results files of shards to merge into --results-file, or to commit with --testrail-commit, then exit (OPTIONAL)"
+    )
+    parser.add_option(
+        "--replay-results",
+        help="Comma-separated list of results journals of interrupted runs to commit to TestRail with --testrail-token, then exit (OPTIONAL)"
+    )
     parser.add_option(
         "--work-folder",
         help="Work folder. Will be created if required"
@@ -852,6 +2578,83 @@ def main(argv):
         dest="no_fetch",
         help="The git files are not updated from GitHub, usually for debugging puroses (OPTIONAL)"
     )
+    parser.add_option(
+        "--fetch-workers",
+        type="int",
+        default=4,
+        help="Number of concurrent downloads when getting files from GitHub (OPTIONAL, defaults to 4)"
+    )
+    parser.add_option(
+        "--sync-workers",
+        type="int",
+        default=4,
+        help="Number of files written concurrently when synchronizing the work folder (OPTIONAL, defaults to 4)"
+    )
+    parser.add_option(
+        "--fetch-mode",
+        type="choice",
+        choices=SeleniumSandbox.fetch_modes,
+        default="recursive",
+        help="How files are fetched from GitHub: 'recursive' lists a whole tree in one call, 'walk' lists one folder per call, 'archive' downloads a single tarball on a cold work folder (OPTIONAL, defaults to recursive)"
+    )
+    parser.add_option(
+        "--http-pool-size",
+        type="int",
+        default=4,
+        help="Number of keep-alive connections shared by the GitHub requests (OPTIONAL, defaults to 4)"
+    )
+    parser.add_option(
+        "--full-sync",
+        action="store_true",
+        dest="full_sync",
+        default=False,
+        help="Check every file of the work folder instead of only those changed since the last synchronization (OPTIONAL)"
+    )
+    parser.add_option(
+        "--compress-objects",
+        action="store_true",
+        dest="compress_objects",
+        default=False,
+        help="Store the new objects fetched from GitHub compressed with zlib (OPTIONAL)"
+    )
+    parser.add_option(
+        "--gc",
+        action="store_true",
+        dest="gc",
+        default=False,
+        help="Remove the objects of the work folder no recent tree refers to, then exit (requires --work-folder). The objects of --shared-objects are only removed to fit in --gc-max-bytes, when unused for a week"
+    )
+    parser.add_option(
+        "--gc-keep-trees",
+        type="int",
+        default=5,
+        help="Number of last synchronized trees whose objects are kept by --gc (OPTIONAL, defaults to 5)"
+    )
+    parser.add_option(
+        "--gc-max-bytes",
+        type="int",
+        default=0,
+        help="Size the object store may keep for objects of older trees, the least recently used being removed first by --gc (OPTIONAL, defaults to 0)"
+    )
+    parser.add_option(
+        "--checkout-mode",
+        type="choice",
+        choices=SeleniumSandbox.checkout_modes,
+        default="copy",
+        help="How files are written to the work folder: 'copy' copies the objects, 'link' reflinks or hardlinks them when possible, leaving hardlinked files read-only (OPTIONAL, defaults to copy)"
+    )
+    parser.add_option(
+        "--shared-objects",
+        dest="shared_objects",
+        help="Folder of an object cache shared by several work folders, where new objects are stored (OPTIONAL)"
+    )
+    parser.add_option(
+        "--pack-objects",
+        action="store_true",
+        dest="pack_objects",
+        default=False,
+        help="Move the loose objects of the work folder into its pack and exit, no other option than --work-folder is needed (OPTIONAL)"
+    )
     parser.add_option(
         "-v",
         "--verbose",
@@ -861,6 +2664,72 @@ def main(argv):
     )
     (options, args) = parser.parse_args()
 
+    if options.pack_objects:
+        if options.work_folder is None:
+            parser.error("A pack-objects argument requires a work folder.")
+        objects_folder = os.path.join(options.work_folder, ".git", "objects")
+        if not os.path.exists(objects_folder):
+            parser.error("No objects found in work folder %s" % options.work_folder)
+        print("INFO: Packing objects of work folder %s" % options.work_folder)
+        (count, size) = objectStore.ObjectStore(objects_folder).pack_objects()
+        print("INFO:     Packed %d objects (%d bytes)" % (count, size))
+        if options.shared_objects and os.path.exists(options.shared_objects):
+            print("INFO: Packing objects of shared object cache %s" % options.shared_objects)
+            (count, size) = objectStore.ObjectStore(options.shared_objects).pack_objects()
+            print("INFO:     Packed %d objects (%d bytes)" % (count, size))
+        sys.exit(0)
+
+    if options.merge_results:
+        if not (options.results_file or (options.testrail_commit and options.testrail_token)):
+            parser.error("A merge-results argument requires a results-file argument, or testrail-commit and testrail-token arguments.")
+        runs = merge_results(options.merge_results.split(","))
+        for run in sorted(runs.keys()):
+            print("INFO: Merged %d results for TestRail run R%s" % (len(runs[run]["results"]), run))
+        if options.results_file:
+            save_results(options.results_file, runs)
+            print("INFO: Saved merged results to %s" % options.results_file)
+        if options.testrail_commit and options.testrail_token:
+            journal_file = os.path.join(os.path.dirname(os.path.abspath(options.merge_results.split(",")[0])), "merged_results.jsonl")
+            committer = ResultCommitter(get_testrail_client(options.testrail_token, timeout=options.testrail_timeout), journal_file)
+            for run in sorted(runs.keys()):
+                for result in runs[run]["results"]:
+                    committer.add(run, result)
+            uncommitted = committer.close()
+            if uncommitted:
+                print("ERROR: %d results could not be committed to TestRail (%s), replay them with --replay-results %s" % (
+                    uncommitted, committer.error, journal_file
+                ))
+                sys.exit(1)
+            print("INFO: Committed merged results to TestRail")
+        sys.exit(0)
+
+    if options.replay_results:
+        if not options.testrail_token:
+            parser.error("A replay-results argument requires a testrail-token argument.")
+        client = get_testrail_client(options.testrail_token, timeout=options.testrail_timeout)
+        exit_code = 0
+        for journal_file in options.replay_results.split(","):
+            # The journal is resumed into itself, which marks what gets
+            # committed: replaying it again does not commit it twice.
+            committer = ResultCommitter(client, journal_file)
+            count = committer.resume(journal_file)
+            uncommitted = committer.close()
+            print("INFO: Committed %d of %d results left in %s" % (count - uncommitted, count, journal_file))
+            if uncommitted:
+                print("ERROR: %d results could not be committed to TestRail (%s)" % (uncommitted, committer.error))
+                exit_code = 1
+        sys.exit(exit_code)
+
+    if options.gc:
+        if options.work_folder is None:
+            parser.error("A gc argument requires a work folder.")
+        if not os.path.exists(os.path.join(options.work_folder, ".git", "objects")):
+            parser.error("No objects found in work folder %s" % options.work_folder)
+        print("INFO: Collecting garbage of work folder %s" % options.work_folder)
+        (count, size) = collect_garbage(options.work_folder, options.gc_keep_trees, options.gc_max_bytes, options.shared_objects)
+        print("INFO:     Reclaimed %d objects (%d bytes)" % (count, size))
+        sys.exit(0)
+
     if options.verbose is None:
         options.verbose = False
 
@@ -873,6 +2742,39 @@ def main(argv):
     if options.testrail_token is None:
         options.testrail_token = ''
 
+    if options.fetch_workers < 1:
+        parser.error("A fetch-workers argument must be at least 1.")
+
+    if options.shard_count < 1 or not 0 <= options.shard_index < options.shard_count:
+        parser.error("A shard-index argument must be at least 0 and lower than the shard-count argument.")
+
+    if options.duration_history is None:
+        options.duration_history = ""
+
+    if options.shard_weighted and not options.duration_history:
+        parser.error("A shard-weighted argument requires a duration-history argument, the same for every shard.")
+
+    if options.results_file is None:
+        options.results_file = ""
+
+    if options.merge_results is None:
+        options.merge_results = ""
+
+    if options.replay_results is None:
+        options.replay_results = ""
+
+    if options.commit_batch_size < 1:
+        parser.error("A commit-batch-size argument must be at least 1.")
+
+    if options.jobs < 1:
+        parser.error("A jobs argument must be at least 1.")
+
+    if options.sync_workers < 1:
+        parser.error("A sync-workers argument must be at least 1.")
+
+    if options.http_pool_size < 1:
+        parser.error("A http-pool-size argument must be at least 1.")
+
     if options.suites is None:
         options.suites = []
     else:
@@ -901,6 +2803,9 @@ def main(argv):
     if options.config_xml_file is None:
         options.config_xml_file = ""
 
+    if options.shared_objects is None:
+        options.shared_objects = ""
+
     if (options.suites and options.testrail_targets):
         parser.error("Options --suites and --testrail-targets are mutually exclusive.")
 
@@ -923,13 +2828,42 @@ def main(argv):
 
     shotgun_url = "%s://%s" % (url.scheme, url.netloc)
 
+    print "INFO: Setting work folder to %s" % options.work_folder
+    if options.shared_objects:
+        print "INFO: Sharing objects through %s" % options.shared_objects
+    if not os.path.exists(options.work_folder):
+        print "INFO:    Creating work folder %s" % options.work_folder
+        os.makedirs(options.work_folder)
+
     if options.testrail_token:
         print "INFO: Connecting to GitHub and TestRail"
     else:
         print "INFO: Connecting to GitHub"
-    sandbox = SeleniumSandbox(options.git_token, options.testrail_token, options.verbose)
+    sandbox = SeleniumSandbox(
+        options.git_token, options.testrail_token, options.verbose,
+        fetch_workers=options.fetch_workers,
+        sync_workers=options.sync_workers,
+        fetch_mode=options.fetch_mode,
+        http_pool_size=options.http_pool_size,
+        work_folder=options.work_folder,
+        compress_objects=options.compress_objects,
+        checkout_mode=options.checkout_mode,
+        shared_objects_folder=options.shared_objects,
+        commit_batch_size=options.commit_batch_size,
+        commit_interval=options.commit_interval,
+        testrail_timeout=options.testrail_timeout
+    )
     signal.signal(signal.SIGINT, sandbox.signal_handler)
     signal.signal(signal.SIGTERM, sandbox.signal_handler)
+    # Weighted shards are computed from the duration history given, which
+    # the shards do not write to, as they would each write different
+    # durations to it.
+    if options.shard_weighted:
+        sandbox.set_shard(options.shard_index, options.shard_count, DurationHistory(options.duration_history))
+    else:
+        if options.duration_history:
+            sandbox.duration_history = DurationHistory(options.duration_history)
+        sandbox.set_shard(options.shard_index, options.shard_count)
     print "INFO:     Connected to GitHub as user %s" % sandbox.get_github_user()
     if options.testrail_token:
         print "INFO:     Connected to TestRail as user %s" % sandbox.get_testrail_user()
@@ -946,12 +2880,6 @@ def main(argv):
         for res_id in sandbox.testrail_plans.keys():
             print "     %s - %s" % (sandbox.testrail_plans[res_id]['name'], res_id)
 
-    print "INFO: Setting work folder to %s" % options.work_folder
-    if not os.path.exists(options.work_folder):
-        print "INFO:    Creating work folder %s" % options.work_folder
-        os.makedirs(options.work_folder)
-    sandbox.set_work_folder(options.work_folder)
-
     if options.no_fetch:
         print("INFO: not fetching files from repo")
         sandbox.get_target_version(shotgun_url)
@@ -960,19 +2888,27 @@ def main(argv):
         sandbox.fetch_shotgun_files(shotgun_url)
         print("INFO:     Found version to be %s (%s)" % (sandbox.target_version_name, sandbox.target_version_hash))
         print("INFO:     Done getting files")
+        if options.verbose:
+            stats = sandbox.get_connection_stats()
+            print("INFO:     HTTP connections: %d new, %d reused" % (stats["new"], stats["reused"]))
+            print("INFO:     Waited %d seconds for the GitHub rate limit" % sandbox.rate_limiter.waited)
 
     if options.no_sync:
         print("INFO: Local work folder files will not be updated.")
         sandbox.update_targets()
     else:
         print("INFO: Synchronizing filesystem with git files")
-        sandbox.sync_filesystem()
+        sandbox.sync_filesystem(full=options.full_sync)
         print("INFO:     Done synchronizing")
+        if options.verbose:
+            stats = sandbox.get_checkout_stats()
+            print("INFO:     Files written: %d reflinked, %d hardlinked, %d copied" % (stats["reflink"], stats["hardlink"], stats["copy"]))
 
     for suite in options.suites:
         if not (sandbox.is_valid_suite(suite)):
             parser.error("ERROR: Invalid test suite: %s" % suite)
 
+    exit_code = 0
     try:
         if options.suites or options.testrail_targets:
             print("INFO: Generating config.xml")
@@ -1003,12 +2939,29 @@ def main(argv):
             sandbox.generate_config(run_options)
 
         if options.suites:
-            for suite in options.suites:
+            suites = options.suites
+            if options.changed_only:
+                changed = sandbox.get_changed_paths(options.suites)
+                suites = [suite for suite in options.suites if suite in changed]
+                for suite in options.suites:
+                    if suite not in changed:
+                        print("INFO: skipping tests from %s as they did not change since the previous version" % suite)
+            if options.jobs > 1:
                 print("INFO:")
-                print("INFO: Running tests from %s" % suite)
-                sandbox.execute_suite(suite)
+                codes = sandbox.execute_suites(suites, options.jobs)
+            else:
+                codes = {}
+                for suite in suites:
+                    print("INFO:")
+                    print("INFO: Running tests from %s" % suite)
+                    codes[suite] = sandbox.execute_suite(suite)
             print("INFO:     Test completed")
+            failed = [suite for suite in suites if codes[suite] != 0]
+            if failed:
+                print("ERROR: Tests failed in %s" % ", ".join(failed))
+                exit_code = 1
         elif options.testrail_targets:
+            run_results = {}
             if options.testrail_run_all:
                 print("WARNING: Executing all of the tests regardless of their prior results")
             else:
@@ -1027,8 +2980,18 @@ def main(argv):
 
                 for run in runs:
                     print("INFO: Using TestRail test run: R%s - %s" % (run, sandbox.testrail_runs[run]['name']))
-                    sandbox.execute_run(run, options.testrail_commit, options.testrail_run_all)
+                    run_results[run] = sandbox.execute_run(run, options.testrail_commit, options.testrail_run_all, options.jobs, options.changed_only)
             print("INFO:     Testing completed")
+            if options.verbose:
+                stats = sandbox.testrail.get_stats()
+                for endpoint in sorted(stats.keys()):
+                    print("INFO:     TestRail %s: %d requests, %d retries, %.2fs average, %.2fs max" % (
+                        endpoint, stats[endpoint]["count"], stats[endpoint]["retries"],
+                        stats[endpoint]["total"] / stats[endpoint]["count"], stats[endpoint]["max"]
+                    ))
+            if options.results_file:
+                save_results(options.results_file, run_results)
+                print("INFO: Saved results to %s" % options.results_file)
             if options.testrail_targets and not options.testrail_commit:
                 print("WARNING: results have not been committed to TestRail")
         else:
@@ -1038,7 +3001,7 @@ def main(argv):
         print("ERROR: This Shotgun site does not support Selenium automation!")
         sys.exit(2)
 
-    sys.exit(0)
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,667 @@
+#!/usr/bin/env python -u
+"""
+Object store for the git objects of a SeleniumSandbox work folder.
+"""
+
+import StringIO
+import binascii
+import contextlib
+import errno
+import fcntl
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+
+def is_zlib_stream(data):
+    """
+    Does data start with a zlib header?
+    """
+    return len(data) >= 2 and ord(data[0]) & 0x0f == 8 and (ord(data[0]) << 8 | ord(data[1])) % 31 == 0
+
+
+def is_compressed(data):
+    """
+    Does data start an object stored compressed?
+    """
+    if not is_zlib_stream(data):
+        return False
+    try:
+        head = zlib.decompressobj().decompress(data)
+    except zlib.error:
+        return False
+    return re.match("(blob|tree) [0-9]+\0", head) is not None
+
+
+def inflate(chunks):
+    """
+    Content of a stored object, from the chunks of its file.
+
+    Objects are either stored raw, or compressed in the git loose object
+    format: a "<kind> <size>\0" header followed by the content, all of it
+    deflated with zlib. Compressed objects are inflated chunk by chunk.
+    """
+    chunks = iter(chunks)
+    first = next(chunks, "")
+    header = None
+    if is_zlib_stream(first):
+        decompressor = zlib.decompressobj()
+        try:
+            head = decompressor.decompress(first)
+            header = re.match("(blob|tree) [0-9]+\0", head)
+        except zlib.error:
+            pass
+    if header is None:
+        yield first
+        for chunk in chunks:
+            yield chunk
+        return
+    yield head[header.end():]
+    for chunk in chunks:
+        yield decompressor.decompress(chunk)
+    yield decompressor.flush()
+
+
+class ObjectPack:
+    """
+    Pack of objects.
+
+    The objects are appended one after the other to the pack file. The
+    index file starts with a header (magic, version, count) followed by one
+    record (binary SHA-1, offset, size) per object, sorted by SHA-1. Both
+    files are read through mmap, and objects are looked up by a binary
+    search of the index.
+    """
+
+    magic = "SBPK"
+    version = 1
+    header = struct.Struct(">4sII")
+    record = struct.Struct(">20sQQ")
+
+    def __init__(self, pack_file, index_file):
+        """
+        Constructor.
+        """
+        self.pack_file = pack_file
+        self.index_file = index_file
+        self.count = 0
+        self.index = None
+        self.pack = None
+        if os.path.exists(index_file):
+            with open(index_file, "rb") as data_file:
+                self.index = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            (magic, version, self.count) = self.header.unpack_from(self.index, 0)
+            if magic != self.magic or version != self.version:
+                raise IOError("%s is not a pack index" % index_file)
+            if self.count > 0:
+                with open(pack_file, "rb") as data_file:
+                    self.pack = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def entry(self, i):
+        """
+        Record i of the index, as (hex SHA-1, offset, size).
+        """
+        (sha, offset, size) = self.record.unpack_from(self.index, self.header.size + i * self.record.size)
+        return (binascii.hexlify(sha), offset, size)
+
+    def entries(self):
+        """
+        All the records of the index.
+        """
+        for i in range(self.count):
+            yield self.entry(i)
+
+    def bisect(self, sha):
+        """
+        Position of the first record not lower than a hex SHA-1 prefix.
+        """
+        key = binascii.unhexlify((sha + "0" * 40)[:40])
+        (low, high) = (0, self.count)
+        while low < high:
+            middle = (low + high) // 2
+            offset = self.header.size + middle * self.record.size
+            if self.index[offset:offset + 20] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, sha):
+        """
+        Full SHA-1 of the objects starting with a SHA-1 prefix.
+        """
+        matches = []
+        i = self.bisect(sha)
+        while i < self.count:
+            entry = self.entry(i)
+            if not entry[0].startswith(sha):
+                break
+            matches.append(entry[0])
+            i += 1
+        return matches
+
+    def locate(self, sha):
+        """
+        Offset and size of an object, or None.
+        """
+        i = self.bisect(sha)
+        if i < self.count:
+            entry = self.entry(i)
+            if entry[0] == sha:
+                return entry[1:]
+        return None
+
+    def read(self, sha, chunk_size=65536):
+        """
+        Read the stored bytes of an object, chunk by chunk.
+        """
+        location = self.locate(sha)
+        if location is None:
+            raise KeyError("Object %s not found in %s" % (sha, self.pack_file))
+        (offset, size) = location
+        for start in range(offset, offset + size, chunk_size):
+            yield self.pack[start:min(start + chunk_size, offset + size)]
+
+
+class ObjectStore:
+    """
+    Objects kept in the .git/objects folder.
+
+    New objects are written loose and read-only, in the fan-out folders, and
+    compressed with zlib if compress is set; both kinds of objects are read
+    transparently. The SHA-1 of
+    every loose object is kept in an in-memory index, loaded from the disk
+    on first use and updated as objects are written, so that lookups do
+    not have to scan the fan-out folders. pack_objects() moves the loose
+    objects into the pack found in the pack folder, which is read in place,
+    and collect_garbage() removes the objects no tree to keep refers to.
+
+    A shared store, usually a machine-wide cache used by several work
+    folders, can be given: objects missing from this store are then read
+    from it, and new objects are written to it. Several processes may use
+    a store at once: objects are written through atomic renames under a
+    shared lock, and packed under an exclusive one.
+    """
+
+    chunk_size = 65536
+
+    # ioctl cloning a whole file, on the Linux filesystems sharing extents
+    # between files (btrfs, xfs).
+    FICLONE = 0x40049409
+
+    # Errors meaning a file cannot be linked, rather than a failure.
+    link_errors = (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.ENOSYS)
+
+    def __init__(self, objects_folder, compress=False, shared=None):
+        """
+        Constructor.
+        """
+        self.objects_folder = objects_folder
+        self.compress = compress
+        self.shared = shared
+        self.pack_folder = objects_folder + os.path.sep + "pack"
+        self.lock = threading.Lock()
+        self.exclusive = threading.local()
+        self.index = None
+        self.pack = None
+
+    def get_folder(self, sha):
+        """
+        Get object folder.
+        """
+        return self.objects_folder + os.path.sep + sha[:2]
+
+    def get_file(self, sha):
+        """
+        Get object file.
+        """
+        return self.get_folder(sha) + os.path.sep + sha[2:]
+
+    def load_index(self):
+        """
+        Load the index of the objects, bucketed by fan-out folder.
+        """
+        with self.lock:
+            if self.index is not None:
+                return self.index
+            index = {}
+            # The pack and its index are replaced together under an
+            # exclusive lock.
+            with self.locked(fcntl.LOCK_SH):
+                self.pack = ObjectPack(self.get_pack_file(), self.get_pack_index_file())
+            for folder in os.listdir(self.objects_folder):
+                if len(folder) != 2:
+                    continue
+                path = self.objects_folder + os.path.sep + folder
+                if os.path.isdir(path):
+                    index[folder] = set(folder + name for name in os.listdir(path))
+            self.index = index
+            return index
+
+    def add(self, sha):
+        """
+        Add an object to the index.
+        """
+        index = self.load_index()
+        with self.lock:
+            index.setdefault(sha[:2], set()).add(sha)
+
+    def get_pack_file(self):
+        """
+        Get pack file.
+        """
+        return self.pack_folder + os.path.sep + "objects.pack"
+
+    def get_pack_index_file(self):
+        """
+        Get pack index file.
+        """
+        return self.pack_folder + os.path.sep + "objects.idx"
+
+    def find(self, sha):
+        """
+        Find the full SHA-1 of an object from its SHA-1 or a prefix of it.
+
+        Returns None when there is no such object, or when the prefix is
+        ambiguous.
+        """
+        matches = self.find_matches(sha)
+        if self.shared is not None and (len(sha) < 40 or not matches):
+            matches.update(self.shared.find_matches(sha))
+        if len(matches) == 1:
+            return matches.pop()
+        return None
+
+    def find_matches(self, sha):
+        """
+        Full SHA-1 of the objects of this store starting with a SHA-1 prefix.
+        """
+        bucket = self.load_index().get(sha[:2], ())
+        if sha in bucket:
+            return set([sha])
+        if len(sha) == 40:
+            if self.pack.locate(sha) is not None:
+                return set([sha])
+            # Another process may have written the object since the index
+            # was loaded.
+            if os.path.exists(self.get_file(sha)):
+                self.add(sha)
+                return set([sha])
+            return set()
+        with self.lock:
+            matches = set(x for x in bucket if x.startswith(sha))
+        matches.update(self.pack.find(sha))
+        return matches
+
+    def holder(self, sha):
+        """
+        Store holding an object: this store, or else the shared store.
+        """
+        if self.shared is not None and not self.find_matches(sha):
+            return self.shared
+        return self
+
+    def is_loose(self, sha):
+        """
+        Is the object stored loose?
+        """
+        return sha in self.load_index().get(sha[:2], ())
+
+    def reload(self):
+        """
+        Forget the index, to be loaded again on next use.
+        """
+        with self.lock:
+            self.index = None
+
+    def stored_chunks(self, sha):
+        """
+        Stored bytes of an object, chunk by chunk.
+        """
+        store = self.holder(sha)
+        if store is not self:
+            for chunk in store.stored_chunks(sha):
+                yield chunk
+            return
+        if self.is_loose(sha):
+            try:
+                data_file = open(self.get_file(sha), "rb")
+            except IOError as e:
+                # The object may have been packed by another process.
+                if e.errno != errno.ENOENT:
+                    raise
+                self.reload()
+                self.load_index()
+            else:
+                with data_file:
+                    for chunk in iter(lambda: data_file.read(self.chunk_size), ""):
+                        yield chunk
+                return
+        for chunk in self.pack.read(sha, self.chunk_size):
+            yield chunk
+
+    def read(self, sha):
+        """
+        Read an object.
+        """
+        return "".join(inflate(self.stored_chunks(sha)))
+
+    def copy(self, sha, path):
+        """
+        Copy an object to a file.
+        """
+        with open(path, "wb") as data_file:
+            for chunk in inflate(self.stored_chunks(sha)):
+                data_file.write(chunk)
+
+    def reflink(self, source, path):
+        """
+        Clone a file, sharing its blocks until one of them is modified.
+        """
+        if not sys.platform.startswith("linux"):
+            raise IOError(errno.EOPNOTSUPP, "Reflinks are not supported on %s" % sys.platform)
+        with open(source, "rb") as source_file:
+            with open(path, "wb") as data_file:
+                try:
+                    fcntl.ioctl(data_file.fileno(), self.FICLONE, source_file.fileno())
+                except IOError:
+                    os.remove(path)
+                    raise
+
+    def checkout(self, sha, path, perm, link=False):
+        """
+        Write an object to a file with the given permissions.
+
+        With link set, the object file is reflinked where the filesystem
+        supports it, or else hardlinked when the object is read-only with
+        the permissions of the file less the write bits. Objects which are
+        packed, compressed, or on another device are copied. Returns how the
+        file was written: "reflink", "hardlink" or "copy".
+        """
+        store = self.holder(sha)
+        if store is not self:
+            return store.checkout(sha, path, perm, link)
+        if os.path.lexists(path):
+            # The file may be a hardlink to an object: never write through it.
+            os.remove(path)
+        if link and self.is_loose(sha):
+            object_file = self.get_file(sha)
+            try:
+                with open(object_file, "rb") as data_file:
+                    raw = not is_compressed(data_file.read(self.chunk_size))
+                stat_info = os.stat(object_file)
+            except (IOError, OSError) as e:
+                # The object may have been packed by another process.
+                if e.errno != errno.ENOENT:
+                    raise
+                raw = False
+            if raw:
+                try:
+                    self.reflink(object_file, path)
+                    os.chmod(path, perm)
+                    return "reflink"
+                except (IOError, OSError) as e:
+                    if e.errno not in self.link_errors:
+                        raise
+                if stat_info.st_mode & 0777 == perm & ~0222:
+                    try:
+                        os.link(object_file, path)
+                        return "hardlink"
+                    except OSError as e:
+                        if e.errno not in self.link_errors:
+                            raise
+        self.copy(sha, path)
+        os.chmod(path, perm)
+        return "copy"
+
+    def contains(self, sha):
+        """
+        Is the object in the store?
+        """
+        return self.find(sha) is not None
+
+    def write(self, sha, write, kind="blob"):
+        """
+        Write an object.
+
+        The object is written to a temporary file first and then renamed in
+        place, so concurrent writers never expose a partially written object.
+        """
+        if self.shared is not None:
+            return self.shared.write(sha, write, kind)
+        object_file = self.get_file(sha)
+        object_folder = self.get_folder(sha)
+
+        # The temporary file lives outside of the fan-out folders so that it
+        # is never taken for an object.
+        (fd, temp_file) = tempfile.mkstemp(prefix="tmp_obj_", dir=self.objects_folder)
+        try:
+            data_file = os.fdopen(fd, "wb")
+            try:
+                if self.compress:
+                    content = StringIO.StringIO()
+                    write(content)
+                    content = content.getvalue()
+                    data_file.write(zlib.compress("%s %d\0%s" % (kind, len(content), content)))
+                else:
+                    write(data_file)
+            finally:
+                data_file.close()
+            # Objects are read-only, as they may be hardlinked into the work
+            # folder.
+            os.chmod(temp_file, 0444)
+            # The fan-out folder is removed when packing, under an exclusive
+            # lock.
+            with self.locked(fcntl.LOCK_SH):
+                try:
+                    os.mkdir(object_folder)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                os.rename(temp_file, object_file)
+        except Exception:
+            os.remove(temp_file)
+            raise
+        self.add(sha)
+        return object_file
+
+    def pack_objects(self):
+        """
+        Move the loose objects into the pack.
+
+        The loose objects are appended to the pack file, and a new index
+        including them replaces the previous one. Only then are the loose
+        files removed, so that readers always find every object in one
+        place or the other. Returns the number of objects and of bytes
+        packed.
+        """
+        with self.locked(fcntl.LOCK_EX):
+            # The pack may have been changed by another process while
+            # waiting for the lock.
+            self.reload()
+            index = self.load_index()
+            entries = dict((entry[0], entry[1:]) for entry in self.pack.entries())
+            loose = sorted(sha for bucket in index.values() for sha in bucket if sha not in entries)
+
+            packed_bytes = 0
+            with open(self.get_pack_file(), "ab") as pack_file:
+                pack_file.seek(0, os.SEEK_END)
+                for sha in loose:
+                    with open(self.get_file(sha), "rb") as data_file:
+                        data = data_file.read()
+                    entries[sha] = (pack_file.tell(), len(data))
+                    pack_file.write(data)
+                    packed_bytes += len(data)
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+
+            self.write_pack_index(entries)
+
+            for sha in loose:
+                os.remove(self.get_file(sha))
+            for folder in set(sha[:2] for sha in loose):
+                try:
+                    os.rmdir(self.get_folder(folder))
+                except OSError:
+                    pass
+
+            # The mapping of the previous pack is released once no reader
+            # uses it anymore.
+            self.reload()
+            return (len(loose), packed_bytes)
+
+    @contextlib.contextmanager
+    def locked(self, operation):
+        """
+        Hold a lock of the store, shared or exclusive, across processes.
+
+        A thread holding the exclusive lock already holds any other.
+        """
+        if getattr(self.exclusive, "held", False):
+            yield
+            return
+        if not os.path.exists(self.pack_folder):
+            try:
+                os.makedirs(self.pack_folder)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        with open(self.pack_folder + os.path.sep + "lock", "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            self.exclusive.held = operation == fcntl.LOCK_EX
+            try:
+                yield
+            finally:
+                self.exclusive.held = False
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def reachable(self, roots):
+        """
+        SHA-1 of the trees and of every object they refer to.
+
+        Trees missing from the store are skipped.
+        """
+        found = set()
+        trees = list(roots)
+        while trees:
+            sha = trees.pop()
+            if sha in found:
+                continue
+            found.add(sha)
+            if self.find(sha) is None:
+                continue
+            for elem in json.loads(self.read(sha))["tree"]:
+                if elem["type"] == "tree":
+                    trees.append(elem["sha"])
+                else:
+                    found.add(elem["sha"])
+        return found
+
+    def collect_garbage(self, keep, max_bytes=0, min_age=0):
+        """
+        Remove the objects which are not to be kept, least recently used
+        first, until the store fits in max_bytes.
+
+        Loose objects are aged by their last access or modification time,
+        and packed objects by the time the pack was last written, so they
+        go first. Objects used less than min_age seconds ago are kept too.
+        The pack is rewritten without the objects removed from it.
+        Returns the number of objects and of bytes reclaimed.
+        """
+        with self.locked(fcntl.LOCK_EX):
+            self.reload()
+            index = self.load_index()
+            # Objects are both loose and packed when packing was interrupted.
+            objects = {}
+            for sha in (sha for bucket in index.values() for sha in bucket):
+                try:
+                    stat_info = os.stat(self.get_file(sha))
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+                    continue
+                objects[sha] = [max(stat_info.st_atime, stat_info.st_mtime), stat_info.st_size, True, False]
+            if self.pack.count > 0:
+                pack_time = os.stat(self.get_pack_file()).st_mtime
+                for (sha, offset, size) in self.pack.entries():
+                    entry = objects.setdefault(sha, [pack_time, 0, False, False])
+                    entry[1] += size
+                    entry[3] = True
+
+            total = sum(x[1] for x in objects.values())
+            evicted = []
+            unused_since = time.time() - min_age
+            for (used, size, sha) in sorted((x[0], x[1], sha) for (sha, x) in objects.items() if sha not in keep):
+                if used > unused_since:
+                    break
+                if total <= max_bytes:
+                    break
+                evicted.append((sha, size))
+                total -= size
+
+            packed = set(sha for (sha, size) in evicted if objects[sha][3])
+            if packed:
+                self.rewrite_pack(packed)
+            loose = [sha for (sha, size) in evicted if objects[sha][2]]
+            for sha in loose:
+                os.remove(self.get_file(sha))
+            for folder in set(sha[:2] for sha in loose):
+                try:
+                    os.rmdir(self.get_folder(folder))
+                except OSError:
+                    pass
+
+            self.reload()
+            return (len(evicted), sum(size for (sha, size) in evicted))
+
+    def rewrite_pack(self, removed):
+        """
+        Rewrite the pack without some of its objects.
+
+        The new pack and index are renamed in place of the previous ones
+        while holding the exclusive lock, which readers take to open them.
+        """
+        entries = {}
+        (fd, temp_file) = tempfile.mkstemp(prefix="tmp_pack_", dir=self.pack_folder)
+        try:
+            with os.fdopen(fd, "wb") as pack_file:
+                for (sha, offset, size) in self.pack.entries():
+                    if sha in removed:
+                        continue
+                    entries[sha] = (pack_file.tell(), size)
+                    for chunk in self.pack.read(sha, self.chunk_size):
+                        pack_file.write(chunk)
+                pack_file.flush()
+                os.fsync(pack_file.fileno())
+            os.chmod(temp_file, 0644)
+            os.rename(temp_file, self.get_pack_file())
+        except Exception:
+            os.remove(temp_file)
+            raise
+        self.write_pack_index(entries)
+
+    def write_pack_index(self, entries):
+        """
+        Replace the pack index.
+        """
+        (fd, temp_file) = tempfile.mkstemp(prefix="tmp_idx_", dir=self.pack_folder)
+        try:
+            with os.fdopen(fd, "wb") as data_file:
+                data_file.write(ObjectPack.header.pack(ObjectPack.magic, ObjectPack.version, len(entries)))
+                for sha in sorted(entries.keys()):
+                    (offset, size) = entries[sha]
+                    data_file.write(ObjectPack.record.pack(binascii.unhexlify(sha), offset, size))
+                data_file.flush()
+                os.fsync(data_file.fileno())
+            os.chmod(temp_file, 0644)
+            os.rename(temp_file, self.get_pack_index_file())
+        except Exception:
+            os.remove(temp_file)
+            raise
@@ -46,6 +46,7 @@ class MyPrefsGUI(QtGui.QDialog):
         self.dialog.setupUi(self)
         self.dialog.browseWorkFolderButton.clicked.connect(self.browse_work_folder_dialog)
         self.dialog.browseConfigFileButton.clicked.connect(self.browse_config_xml_dialog)
+        self.dialog.browseSharedObjectsFolderButton.clicked.connect(self.browse_shared_objects_folder_dialog)
         self.get_prefs()
 
     def get_prefs(self):
@@ -61,6 +62,7 @@ class MyPrefsGUI(QtGui.QDialog):
         self.dialog.workFolderEdit.setText(work_folder)
         config_xml_file = self.prefs.get_pref("config_xml_file") or os.path.expanduser("~/sg_automation.config.xml")
         self.dialog.configFileEdit.setText(config_xml_file)
+        self.dialog.sharedObjectsFolderEdit.setText(self.prefs.get_pref("shared_objects_folder") or "")
         seen = set()
         web_sites = self.prefs.get_pref("web_sites") or [u"https://6-3-develop.shotgunstudio.com"]
         web_sites = [i for i in map(unicode.strip, web_sites) if not (i in seen or seen.add(i))]
@@ -83,6 +85,8 @@ class MyPrefsGUI(QtGui.QDialog):
         config_xml_file = self.dialog.configFileEdit.text()
         self.prefs.set_pref("config_xml_file", config_xml_file)
 
+        self.prefs.set_pref("shared_objects_folder", self.dialog.sharedObjectsFolderEdit.text())
+
         lines = self.dialog.sitesList.toPlainText().split("\n")
         web_sites = []
         for line in lines:
@@ -100,6 +104,15 @@ class MyPrefsGUI(QtGui.QDialog):
         if folder:
             self.dialog.workFolderEdit.setText(folder)
 
+    def browse_shared_objects_folder_dialog(self):
+        """
+        Browse to the shared objects folder.
+        """
+        start_folder = self.dialog.sharedObjectsFolderEdit.text() or os.path.expanduser("~/.")
+        folder = QtGui.QFileDialog.getExistingDirectory(self, "Select the folder where objects are shared by work folders", start_folder)
+        if folder:
+            self.dialog.sharedObjectsFolderEdit.setText(folder)
+
     def browse_config_xml_dialog(self):
         """
         Browse to the work folder.
@@ -123,6 +136,7 @@ class MyMainGUI(QtGui.QMainWindow):
         """
         super(MyMainGUI, self).__init__()
         self.prefs = prefs
+        self.sandbox = None
         self.overwrite_last_line = True
         self.currentLocation = os.path.dirname(os.path.realpath(__file__))
 
@@ -221,9 +235,10 @@ class MyMainGUI(QtGui.QMainWindow):
                 )
             self.sandbox = SeleniumSandbox.SeleniumSandbox(
                 git_token=git_creds,
-                testrail_token=testrail_creds
+                testrail_token=testrail_creds,
+                work_folder=self.prefs.get_pref("work_folder"),
+                shared_objects_folder=self.prefs.get_pref("shared_objects_folder")
             )
-            self.sandbox.set_work_folder(self.prefs.get_pref("work_folder"))
             github_user = self.sandbox.get_github_user()
             message = 'Logged to GitHub as user %s' % github_user
             if self.sandbox.is_using_testrail():
@@ -418,9 +433,14 @@ class MyMainGUI(QtGui.QMainWindow):
         args = [
             "--git-token", "%s:x-oauth-basic" % self.prefs.get_pref("github_api_key"),
             "--work-folder", self.prefs.get_pref("work_folder"),
-            "--no-fetch", "--no-sync",
-            self.ui.siteList.currentText()
+            "--no-fetch", "--no-sync"
         ]
+        # Objects shared by several work folders are kept in a machine-wide
+        # cache, set in the preferences file.
+        shared_objects_folder = self.prefs.get_pref("shared_objects_folder")
+        if shared_objects_folder:
+            args += ["--shared-objects", shared_objects_folder]
+        args.append(self.ui.siteList.currentText())
 
         if current_tab_index == 0:
             args += [
@@ -466,13 +486,19 @@ class MyMainGUI(QtGui.QMainWindow):
         """
         Get the files from the GitHub.
         """
-        self.process.start(os.path.join(self.currentLocation, "SeleniumSandbox.py"), [
+        args = [
             "--git-token", "%s:x-oauth-basic" % self.prefs.get_pref("github_api_key"),
             # "--no-fetch", "--no-sync",
             "--work-folder", self.prefs.get_pref("work_folder"),
             # "--verbose",
-            self.ui.siteList.currentText()
-        ])
+        ]
+        # Objects shared by several work folders are kept in a machine-wide
+        # cache, set in the preferences file.
+        shared_objects_folder = self.prefs.get_pref("shared_objects_folder")
+        if shared_objects_folder:
+            args += ["--shared-objects", shared_objects_folder]
+        args.append(self.ui.siteList.currentText())
+        self.process.start(os.path.join(self.currentLocation, "SeleniumSandbox.py"), args)
 
     def update_test_rail_target_list(self):
         """
@@ -505,13 +531,19 @@ class MyMainGUI(QtGui.QMainWindow):
         """
         Update the tagets.
         """
-        workfolder_location = os.path.join(self.currentLocation, self.prefs.get_pref("work_folder"))
-        file_list = locate_files('runTest.command', workfolder_location)
-        suite_list = []
         current_selection = self.ui.testSuitesTargetList.currentText()
-        suite_pattern = re.compile("%s/(suites.*)/runTest.command" % workfolder_location)
-        for filename in file_list:
-            suite_list.append(suite_pattern.sub(r'\1', filename))
+        if self.sandbox is not None and self.sandbox.get_work_folder():
+            # The suites come from the discovery index of the synchronized
+            # tree, the work folder is not walked.
+            self.sandbox.update_targets()
+            suite_list = sorted(self.sandbox.available_suites.keys())
+        else:
+            workfolder_location = os.path.join(self.currentLocation, self.prefs.get_pref("work_folder"))
+            file_list = locate_files('runTest.command', workfolder_location)
+            suite_list = []
+            suite_pattern = re.compile("%s/(suites.*)/runTest.command" % workfolder_location)
+            for filename in file_list:
+                suite_list.append(suite_pattern.sub(r'\1', filename))
 
         self.ui.testSuitesTargetList.clear()
         self.ui.testSuitesTargetList.addItems(suite_list)
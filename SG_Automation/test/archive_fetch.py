@@ -0,0 +1,89 @@
+#!/usr/bin/env python -u
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestArchiveFetch(unittest.TestCase):
+    files = {
+        "README": "Not part of the selenium tree\n",
+        "test": {
+            "selenium": {
+                "library": {"common.js": "var common = 1;\n"},
+                "suites": {
+                    "smoke": {
+                        "C1234": {"runTest.command": "#!/bin/bash\n", "suite.html": "<html/>\n"},
+                        "runTest.command": "#!/bin/bash\n",
+                    },
+                },
+            },
+        },
+    }
+
+    def setUp(self):
+        self.stub = GitHubStub(self.files)
+        self.work_folder = tempfile.mkdtemp()
+        self.sandbox = SeleniumSandbox.SeleniumSandbox("token", fetch_mode="archive", github_url=self.stub.url)
+        self.sandbox.set_work_folder(self.work_folder)
+
+    def tearDown(self):
+        self.sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def test_archive_stores_selenium_blobs(self):
+        self.sandbox.fetch_archive(self.stub.ref, "test/selenium")
+        readme = self.stub.add_blob(self.files["README"])
+        for (sha, data) in self.stub.blobs.items():
+            if sha == readme:
+                self.assertFalse(self.sandbox.has_git_object(sha))
+            else:
+                self.assertTrue(self.sandbox.has_git_object(sha))
+                self.assertEqual(open(self.sandbox.get_git_object_file(sha), "rb").read(), data)
+
+    def test_fetch_after_archive_downloads_no_blob(self):
+        sha = self.stub.find("test/selenium")
+        self.sandbox.fetch_archive(self.stub.ref, "test/selenium")
+        self.sandbox.fetch_tree(sha)
+        self.assertEqual([x for x in self.stub.requests if "/git/blobs/" in x], [])
+        self.assertEqual(len([x for x in self.stub.requests if "/tarball/" in x]), 1)
+
+        self.sandbox.shotgun_version = self.stub.root
+        self.sandbox.sync_filesystem()
+        self.assertEqual(self.sandbox.available_cases.keys(), [1234])
+
+    def sync_from_pack(self):
+        """
+        Sync the work folder from packed objects only.
+        """
+        sha = self.stub.find("test/selenium")
+        self.sandbox.fetch_archive(self.stub.ref, "test/selenium")
+        self.sandbox.fetch_tree(sha)
+        self.sandbox.object_store.pack_objects()
+        self.sandbox.shotgun_version = self.stub.root
+        self.sandbox.sync_filesystem()
+        command = os.path.join(self.work_folder, "suites", "smoke", "C1234", "runTest.command")
+        self.assertEqual(open(command).read(), "#!/bin/bash\n")
+        self.assertTrue(os.access(command, os.X_OK))
+
+    def test_sync_from_pack(self):
+        self.sync_from_pack()
+        self.assertFalse(self.sandbox.object_store.compress)
+
+    def test_sync_from_compressed_pack(self):
+        self.sandbox.compress_objects = True
+        self.sandbox.set_work_folder(self.work_folder)
+        self.sync_from_pack()
+
+
+if __name__ == '__main__':
+    unittest.main()
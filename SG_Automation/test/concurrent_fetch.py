@@ -0,0 +1,82 @@
+#!/usr/bin/env python -u
+
+import StringIO
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestConcurrentFetch(unittest.TestCase):
+    files = {
+        "test": {
+            "selenium": {
+                "library": dict(("lib%d.js" % i, "var lib = %d;\n" % i) for i in range(30)),
+                "suites": dict(("C%d" % i, {"runTest.command": "#!/bin/bash\necho %d\n" % i}) for i in range(10)),
+            },
+        },
+    }
+
+    def setUp(self):
+        self.stub = GitHubStub(self.files)
+        self.work_folder = tempfile.mkdtemp()
+        self.selenium = self.stub.find("test/selenium")
+
+    def tearDown(self):
+        self.sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def fetch(self, workers):
+        """
+        Fetch the selenium tree with workers threads, returning the output.
+        """
+        self.sandbox = SeleniumSandbox.SeleniumSandbox("token", fetch_workers=workers, github_url=self.stub.url, work_folder=self.work_folder)
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            self.sandbox.fetch_tree(self.selenium)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_every_blob_is_fetched(self):
+        threads = set()
+        get_blob = SeleniumSandbox.SeleniumSandbox.get_blob
+
+        def record_thread(sandbox, elem):
+            threads.add(threading.current_thread().name)
+            get_blob(sandbox, elem)
+
+        SeleniumSandbox.SeleniumSandbox.get_blob = record_thread
+        try:
+            output = self.fetch(4)
+        finally:
+            SeleniumSandbox.SeleniumSandbox.get_blob = get_blob
+        for (sha, data) in self.stub.blobs.items():
+            self.assertEqual(self.sandbox.object_store.read(sha), data)
+        self.assertEqual(len([x for x in self.stub.requests if "/git/blobs/" in x]), len(self.stub.blobs))
+        self.assertTrue(len(threads) > 1)
+        self.assertTrue(all(x.startswith("WorkerPool-") for x in threads))
+        # One progress dot per blob.
+        self.assertEqual(output.count("."), len(self.stub.blobs))
+
+    def test_blob_error_is_raised(self):
+        missing = self.stub.add_blob("var lib = 7;\n")
+        del self.stub.blobs[missing]
+        with self.assertRaises(SeleniumSandbox.GitHubError) as context:
+            self.fetch(4)
+        self.assertIn("404", str(context.exception))
+        self.assertFalse(self.sandbox.has_git_object(missing))
+
+
+if __name__ == '__main__':
+    unittest.main()
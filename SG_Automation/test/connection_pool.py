@@ -0,0 +1,66 @@
+#!/usr/bin/env python -u
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestConnectionPool(unittest.TestCase):
+    files = {
+        "test": {
+            "selenium": {
+                "library": dict(("lib%d.js" % i, "var lib = %d;\n" % i) for i in range(40)),
+                "suites": {"smoke": {"runTest.command": "#!/bin/bash\n"}},
+            },
+        },
+    }
+
+    def setUp(self):
+        self.stub = GitHubStub(self.files)
+        self.work_folder = tempfile.mkdtemp()
+        self.sandboxes = []
+
+    def tearDown(self):
+        for sandbox in self.sandboxes:
+            sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def sandbox(self, **kwargs):
+        sandbox = SeleniumSandbox.SeleniumSandbox("token", github_url=self.stub.url, **kwargs)
+        sandbox.set_work_folder(self.work_folder)
+        self.sandboxes.append(sandbox)
+        return sandbox
+
+    def test_connections_are_reused(self):
+        sandbox = self.sandbox(fetch_workers=4, http_pool_size=2)
+        sandbox.fetch_tree(self.stub.find("test/selenium"))
+        stats = sandbox.get_connection_stats()
+        self.assertTrue(stats["new"] <= 2)
+        self.assertEqual(stats["new"] + stats["reused"], len(self.stub.requests))
+        self.assertEqual(set(self.stub.user_agents), set(["sg-automation"]))
+
+    def test_closed_idle_connection_is_replaced(self):
+        sandbox = self.sandbox(http_pool_size=1)
+        # Drop the kept-alive connection behind the pool's back.
+        for idle in sandbox.http_pool.idle.values():
+            for connection in idle:
+                connection.sock.close()
+        self.assertEqual(sandbox.get_elems("%s/user" % self.stub.url)["login"], "stub")
+        self.assertEqual(sandbox.get_connection_stats(), {"new": 2, "reused": 1})
+
+    def test_http_errors(self):
+        sandbox = self.sandbox()
+        self.assertRaises(SeleniumSandbox.GitHubError, sandbox.get_tree, "0" * 40)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python -u
+"""
+Local stand-in for the GitHub API, serving a small in-memory repository.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import base64
+import hashlib
+import io
+import json
+import tarfile
+import threading
+import urlparse
+
+
+class ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Keep-alive connections need one thread per client.
+    """
+
+    daemon_threads = True
+
+
+class GitHubStub:
+    """
+    GitHub stub.
+
+    The repository is described by a nested dict, where folders are dicts
+    and files are strings, or (string, mode) tuples. Every request path is recorded in requests,
+    its User-Agent in user_agents and the response status in statuses.
+    Canned (status, headers, body) responses queued in failures are
+    returned first, and headers are added to every other response.
+    """
+
+    repo = "repos/shotgunsoftware/shotgun"
+
+    def __init__(self, files, ref="abcdef0"):
+        """
+        Constructor.
+        """
+        self.ref = ref
+        self.trees = {}
+        self.blobs = {}
+        self.requests = []
+        self.statuses = []
+        self.user_agents = []
+        self.failures = []
+        self.headers = []
+        self.files = files
+        self.root = self.add_tree(files)
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                stub.user_agents.append(self.headers.getheader("User-Agent"))
+                (status, headers, body) = stub.handle(self.path, self.headers)
+                stub.statuses.append(status)
+                self.send_response(status)
+                for (key, value) in headers:
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d" % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_blob(self, data):
+        """
+        Add a blob and return its SHA-1.
+        """
+        sha = hashlib.sha1("blob %d\0%s" % (len(data), data)).hexdigest()
+        self.blobs[sha] = data
+        return sha
+
+    def add_tree(self, files):
+        """
+        Add a tree and return its SHA-1.
+        """
+        tree = []
+        for name in sorted(files.keys()):
+            value = files[name]
+            if isinstance(value, dict):
+                sha = self.add_tree(value)
+                tree.append({"path": name, "mode": "040000", "type": "tree", "sha": sha, "url": self.tree_url(sha)})
+            else:
+                mode = "100755" if name.endswith(".command") else "100644"
+                if isinstance(value, tuple):
+                    (value, mode) = value
+                sha = self.add_blob(value)
+                tree.append({"path": name, "mode": mode, "type": "blob", "sha": sha, "size": len(value), "url": self.blob_url(sha)})
+        sha = hashlib.sha1(json.dumps(tree, sort_keys=True)).hexdigest()
+        self.trees[sha] = {"sha": sha, "url": self.tree_url(sha), "tree": tree, "truncated": False}
+        return sha
+
+    def tree_url(self, sha):
+        """
+        Tree URL.
+        """
+        return "%s/git/trees/%s" % (self.repo_url_placeholder(), sha)
+
+    def blob_url(self, sha):
+        """
+        Blob URL.
+        """
+        return "%s/git/blobs/%s" % (self.repo_url_placeholder(), sha)
+
+    def repo_url_placeholder(self):
+        """
+        The server port is not known while the trees are built.
+        """
+        return "{url}/" + self.repo
+
+    def find(self, path):
+        """
+        SHA-1 of the tree at path.
+        """
+        sha = self.root
+        for name in path.split("/"):
+            sha = [x["sha"] for x in self.trees[sha]["tree"] if x["path"] == name][0]
+        return sha
+
+    def tarball(self):
+        """
+        Tarball of the repository, as served by GitHub.
+        """
+        data = io.BytesIO()
+        archive = tarfile.open(fileobj=data, mode="w:gz")
+        top = "shotgunsoftware-shotgun-%s" % self.ref
+
+        def add(files, prefix):
+            for (name, value) in sorted(files.items()):
+                path = prefix + "/" + name
+                info = tarfile.TarInfo(path)
+                if isinstance(value, dict):
+                    info.type = tarfile.DIRTYPE
+                    archive.addfile(info)
+                    add(value, path)
+                else:
+                    if isinstance(value, tuple):
+                        value = value[0]
+                    info.size = len(value)
+                    archive.addfile(info, io.BytesIO(value))
+
+        add(self.files, top)
+        archive.close()
+        return data.getvalue()
+
+    def resolve(self, doc):
+        """
+        Fill in the server URL.
+        """
+        return json.loads(json.dumps(doc).replace("{url}", self.url))
+
+    def handle(self, path, request_headers):
+        """
+        Handle a GET request.
+        """
+        if self.failures:
+            return self.failures.pop(0)
+        (status, headers, body) = self.route(path)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if status == 200 and request_headers.getheader("If-None-Match") == etag:
+            return (304, [("ETag", etag)] + self.headers, "")
+        return (status, headers + [("ETag", etag)] + self.headers, body)
+
+    def route(self, path):
+        """
+        Route a GET request.
+        """
+        url = urlparse.urlparse(path)
+        query = urlparse.parse_qs(url.query)
+        parts = url.path.strip("/").split("/")
+        if url.path == "/user":
+            return (200, [], json.dumps({"login": "stub"}))
+        if url.path.startswith("/%s/tarball/" % self.repo):
+            return (200, [("Content-Type", "application/x-gzip")], self.tarball())
+        if url.path.startswith("/%s/git/trees/" % self.repo):
+            sha = parts[-1]
+            if sha == self.ref:
+                sha = self.root
+            if sha not in self.trees:
+                return (404, [], json.dumps({"message": "Not Found"}))
+            tree = self.trees[sha]
+            if query.get("recursive"):
+                elems = []
+
+                def walk(tree_sha, prefix):
+                    for elem in self.trees[tree_sha]["tree"]:
+                        entry = dict(elem)
+                        entry["path"] = prefix + elem["path"]
+                        elems.append(entry)
+                        if elem["type"] == "tree":
+                            walk(elem["sha"], entry["path"] + "/")
+
+                walk(sha, "")
+                tree = {"sha": sha, "url": tree["url"], "tree": elems, "truncated": False}
+            return (200, [], json.dumps(self.resolve(tree)))
+        if url.path.startswith("/%s/git/blobs/" % self.repo):
+            if parts[-1] not in self.blobs:
+                return (404, [], json.dumps({"message": "Not Found"}))
+            data = self.blobs[parts[-1]]
+            return (200, [], json.dumps({"sha": parts[-1], "encoding": "base64", "content": base64.b64encode(data)}))
+        return (404, [], json.dumps({"message": "Not Found"}))
@@ -0,0 +1,56 @@
+#!/usr/bin/env python -u
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestHttpCache(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = GitHubStub({"README": "Hello\n"})
+        self.work_folder = tempfile.mkdtemp()
+        self.sandboxes = []
+
+    def tearDown(self):
+        for sandbox in self.sandboxes:
+            sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def sandbox(self, **kwargs):
+        sandbox = SeleniumSandbox.SeleniumSandbox("token", github_url=self.stub.url, **kwargs)
+        self.sandboxes.append(sandbox)
+        return sandbox
+
+    def test_user_lookup_is_revalidated(self):
+        self.sandbox(work_folder=self.work_folder)
+        self.stub.requests = []
+        sandbox = self.sandbox(work_folder=self.work_folder)
+        self.assertEqual(sandbox.get_github_user(), "stub")
+        self.assertEqual(self.stub.requests, ["/user"])
+        self.assertEqual(self.stub.statuses[-1], 304)
+        cache_file = sandbox.get_http_cache_file("%s/user" % self.stub.url)
+        self.assertTrue(os.path.exists(cache_file))
+
+    def test_git_objects_are_not_cached(self):
+        sandbox = self.sandbox(work_folder=self.work_folder)
+        self.assertEqual(sandbox.get_http_cache_file("%s/git/trees/%s" % (sandbox.github_repo_url, self.stub.root)), None)
+        sandbox.get_tree(self.stub.root)
+        self.assertEqual(len(os.listdir(sandbox.http_cache_folder)), 1)
+
+    def test_no_cache_without_work_folder(self):
+        sandbox = self.sandbox()
+        self.assertEqual(sandbox.get_http_cache_file("%s/user" % self.stub.url), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python -u
+"""
+Compares the size and read time of raw and zlib compressed objects.
+
+usage: object_compression_benchmark.py [folder]
+
+The objects are made from the files found in folder, e.g. the suites of a
+work folder, or from generated Selenium suites and trees when no folder
+is given.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import objectStore
+
+
+def generated_objects(count=2000):
+    step = '<tr>\n\t<td>clickAndWait</td>\n\t<td>//div[@id="page_%d"]/a[%d]</td>\n\t<td></td>\n</tr>\n'
+    for i in range(count):
+        suite = "<html><body><table>\n%s</table></body></html>\n" % "".join(step % (i, j) for j in range(i % 50 + 5))
+        yield ("blob", suite)
+        if i % 10 == 0:
+            tree = [{"path": "C%d" % (i + j), "mode": "040000", "type": "tree", "sha": hashlib.sha1(str(i + j)).hexdigest()} for j in range(10)]
+            yield ("tree", json.dumps({"sha": hashlib.sha1(str(i)).hexdigest(), "tree": tree, "truncated": False}))
+
+
+def folder_objects(folder):
+    for (path, dirs, files) in os.walk(folder):
+        dirs[:] = [d for d in dirs if d != ".git"]
+        for filename in files:
+            filename = os.path.join(path, filename)
+            if os.path.isfile(filename) and not os.path.islink(filename):
+                yield ("blob", open(filename, "rb").read())
+
+
+def disk_usage(folder):
+    (size, blocks) = (0, 0)
+    for (path, dirs, files) in os.walk(folder):
+        for filename in files:
+            stat_info = os.lstat(os.path.join(path, filename))
+            size += stat_info.st_size
+            blocks += stat_info.st_blocks * 512
+    return (size, blocks)
+
+
+def measure(objects, compress):
+    objects_folder = tempfile.mkdtemp()
+    try:
+        store = objectStore.ObjectStore(objects_folder, compress)
+        shas = []
+        start = time.time()
+        for (kind, data) in objects:
+            sha = hashlib.sha1("%s %d\0%s" % (kind, len(data), data)).hexdigest()
+            store.write(sha, lambda data_file: data_file.write(data), kind)
+            shas.append(sha)
+        write_time = time.time() - start
+
+        store = objectStore.ObjectStore(objects_folder)
+        start = time.time()
+        for sha in shas:
+            store.read(sha)
+        read_time = time.time() - start
+
+        usage = disk_usage(objects_folder)
+        copy_folder = objects_folder + os.path.sep + "copy"
+        os.mkdir(copy_folder)
+        start = time.time()
+        for sha in shas:
+            store.copy(sha, copy_folder + os.path.sep + sha)
+        copy_time = time.time() - start
+        return usage + (write_time, read_time, copy_time)
+    finally:
+        shutil.rmtree(objects_folder)
+
+
+def main(argv):
+    if argv:
+        objects = list(folder_objects(argv[0]))
+    else:
+        objects = list(generated_objects())
+    content = sum(len(data) for (kind, data) in objects)
+    print "%d objects, %d bytes of content" % (len(objects), content)
+    print "                   bytes   disk bytes      write       read       copy"
+    results = {}
+    for compress in (False, True):
+        results[compress] = measure(objects, compress)
+        print "  %-10s %12d %12d %9.3fs %9.3fs %9.3fs" % (("zlib" if compress else "raw",) + results[compress])
+    print "  saved %.1f%% of the bytes and %.1f%% of the disk usage, compressed/raw read time: %.2fx" % (
+        100.0 * (1 - float(results[True][0]) / results[False][0]),
+        100.0 * (1 - float(results[True][1]) / results[False][1]),
+        results[True][3] / results[False][3]
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
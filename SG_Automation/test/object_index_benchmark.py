@@ -0,0 +1,67 @@
+#!/usr/bin/env python -u
+"""
+Compares the object index lookups with the glob based lookups it replaced.
+
+usage: object_index_benchmark.py [objects] [lookups]
+"""
+
+import glob
+import hashlib
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import objectStore
+
+
+def glob_has_object(store, sha):
+    return len(glob.glob(store.get_file(sha) + "*")) == 1
+
+
+def main(argv):
+    count = int(argv[0]) if len(argv) > 0 else 20000
+    lookups = int(argv[1]) if len(argv) > 1 else 5000
+    objects_folder = tempfile.mkdtemp()
+    try:
+        store = objectStore.ObjectStore(objects_folder)
+        shas = [hashlib.sha1(str(i)).hexdigest() for i in range(count)]
+        for sha in shas:
+            store.write(sha, lambda data_file: data_file.write(sha))
+        missing = [hashlib.sha1("missing %d" % i).hexdigest() for i in range(lookups)]
+        targets = random.sample(shas, min(lookups, count)) + missing
+
+        start = time.time()
+        for sha in targets:
+            glob_has_object(store, sha)
+        glob_time = time.time() - start
+
+        start = time.time()
+        store = objectStore.ObjectStore(objects_folder)
+        store.load_index()
+        load_time = time.time() - start
+        start = time.time()
+        for sha in targets:
+            store.contains(sha)
+        index_time = time.time() - start
+
+        start = time.time()
+        for sha in targets:
+            store.contains(sha[:7])
+        prefix_time = time.time() - start
+
+        print "%d objects, %d lookups (half of them missing)" % (count, len(targets))
+        print "  glob:         %8.3fs" % glob_time
+        print "  index load:   %8.3fs" % load_time
+        print "  index:        %8.3fs" % index_time
+        print "  index prefix: %8.3fs" % prefix_time
+    finally:
+        shutil.rmtree(objects_folder)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
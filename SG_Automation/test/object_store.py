@@ -0,0 +1,207 @@
+#!/usr/bin/env python -u
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import objectStore
+
+
+class TestObjectStore(unittest.TestCase):
+
+    def setUp(self):
+        self.objects_folder = tempfile.mkdtemp()
+        self.store = objectStore.ObjectStore(self.objects_folder)
+
+    def tearDown(self):
+        shutil.rmtree(self.objects_folder)
+
+    def write(self, store, sha, data="data"):
+        return store.write(sha, lambda data_file: data_file.write(data))
+
+    def test_lookups(self):
+        self.write(self.store, "ab" + "1" * 38)
+        self.write(self.store, "ab" + "12" + "3" * 36)
+        self.assertTrue(self.store.contains("ab" + "1" * 38))
+        self.assertFalse(self.store.contains("ab" + "2" * 38))
+        self.assertEqual(self.store.find("ab11"), "ab" + "1" * 38)
+        # Ambiguous prefixes are not found, as with the glob lookups.
+        self.assertEqual(self.store.find("ab1"), None)
+
+    def test_index_is_loaded_from_disk(self):
+        sha = "cd" + "4" * 38
+        self.write(self.store, sha)
+        store = objectStore.ObjectStore(self.objects_folder)
+        self.assertEqual(store.find("cd44444"), sha)
+        self.assertEqual(sorted(os.listdir(self.objects_folder)), ["cd", "pack"])
+
+    def test_objects_written_by_other_stores(self):
+        sha = "ef" + "5" * 38
+        self.store.load_index()
+        self.write(objectStore.ObjectStore(self.objects_folder), sha)
+        self.assertTrue(self.store.contains(sha))
+
+    def test_pack_objects(self):
+        shas = ["%02x" % i + "6" * 38 for i in range(10)]
+        for sha in shas:
+            self.write(self.store, sha, "data of %s" % sha)
+        self.assertEqual(self.store.pack_objects(), (10, 10 * len("data of ") + 10 * 40))
+        self.assertEqual(sorted(os.listdir(self.objects_folder)), ["pack"])
+
+        store = objectStore.ObjectStore(self.objects_folder)
+        for sha in shas:
+            self.assertTrue(store.contains(sha))
+            self.assertEqual(store.read(sha), "data of %s" % sha)
+        self.assertEqual(store.find("05666"), shas[5])
+        self.assertFalse(store.contains("ff" + "6" * 38))
+
+        # Packing again appends the new loose objects to the pack.
+        self.write(store, "0566" + "7" * 36, "more")
+        self.assertEqual(store.find("0566"), None)
+        self.assertEqual(store.pack_objects(), (1, 4))
+        self.assertEqual(store.read("0566" + "7" * 36), "more")
+        self.assertEqual(store.read(shas[9]), "data of %s" % shas[9])
+
+    def test_copy_packed_object(self):
+        sha = "12" + "8" * 38
+        self.write(self.store, sha, "packed")
+        self.store.pack_objects()
+        path = os.path.join(self.objects_folder, "copy")
+        self.store.copy(sha, path)
+        self.assertEqual(open(path).read(), "packed")
+
+    def test_compressed_objects(self):
+        store = objectStore.ObjectStore(self.objects_folder, compress=True)
+        data = "<html>%s</html>" % ("<tr><td>open</td></tr>" * 10000)
+        blob = self.write(store, "34" + "9" * 38, data)
+        tree = store.write("56" + "9" * 38, lambda data_file: data_file.write("{}"), "tree")
+        self.assertEqual(zlib.decompress(open(blob, "rb").read()), "blob %d\0%s" % (len(data), data))
+        self.assertEqual(zlib.decompress(open(tree, "rb").read()), "tree 2\0{}")
+        self.assertTrue(os.path.getsize(blob) < len(data) / 10)
+
+        # Raw and compressed objects can be mixed, loose or packed.
+        raw = self.write(self.store, "78" + "9" * 38, "x raw")
+        for packed in (False, True):
+            if packed:
+                store.pack_objects()
+            store = objectStore.ObjectStore(self.objects_folder)
+            self.assertEqual(store.read("34" + "9" * 38), data)
+            self.assertEqual(store.read("56" + "9" * 38), "{}")
+            self.assertEqual(store.read("78" + "9" * 38), "x raw")
+            path = os.path.join(self.objects_folder, "copy")
+            store.copy("34" + "9" * 38, path)
+            self.assertEqual(open(path).read(), data)
+
+    def test_checkout_links(self):
+        sha = "9a" + "1" * 38
+        object_file = self.write(self.store, sha, "linked")
+        path = os.path.join(self.objects_folder, "checkout")
+        how = self.store.checkout(sha, path, 0644, link=True)
+        self.assertIn(how, ("reflink", "hardlink"))
+        if how == "hardlink":
+            self.assertTrue(os.path.samefile(path, object_file))
+            self.assertEqual(os.stat(path).st_mode & 0777, 0444)
+
+        # Checking out over a hardlink never writes through to the object.
+        self.write(self.store, "9b" + "1" * 38, "other")
+        self.assertEqual(self.store.checkout("9b" + "1" * 38, path, 0644), "copy")
+        self.assertEqual(open(path).read(), "other")
+        self.assertEqual(open(object_file).read(), "linked")
+
+        # Executables cannot share the read-only object file.
+        self.assertIn(self.store.checkout(sha, path, 0755, link=True), ("reflink", "copy"))
+        self.assertEqual(os.stat(path).st_mode & 0777, 0755)
+
+        # Compressed and packed objects are copied.
+        store = objectStore.ObjectStore(self.objects_folder, compress=True)
+        self.write(store, "9c" + "1" * 38, "compressed")
+        self.assertEqual(store.checkout("9c" + "1" * 38, path, 0644, link=True), "copy")
+        self.assertEqual(open(path).read(), "compressed")
+        store.pack_objects()
+        self.assertEqual(store.checkout(sha, path, 0644, link=True), "copy")
+        self.assertEqual(open(path).read(), "linked")
+
+    def test_shared_store(self):
+        shared = objectStore.ObjectStore(os.path.join(self.objects_folder, "shared"))
+        os.mkdir(shared.objects_folder)
+        local = objectStore.ObjectStore(os.path.join(self.objects_folder, "local"))
+        os.mkdir(local.objects_folder)
+        self.write(local, "aa" + "1" * 38, "local")
+        first = objectStore.ObjectStore(local.objects_folder, shared=shared)
+        second = objectStore.ObjectStore(os.path.join(self.objects_folder, "second"), shared=shared)
+        os.mkdir(second.objects_folder)
+
+        object_file = self.write(first, "bb" + "1" * 38, "shared")
+        self.assertTrue(object_file.startswith(shared.objects_folder))
+        self.assertEqual(second.read("bb" + "1" * 38), "shared")
+        self.assertEqual(second.find("bb1"), "bb" + "1" * 38)
+        self.assertEqual(first.read("aa" + "1" * 38), "local")
+        self.assertFalse(second.contains("aa" + "1" * 38))
+
+        # Objects packed by another process are still found.
+        objectStore.ObjectStore(shared.objects_folder).pack_objects()
+        path = os.path.join(self.objects_folder, "checkout")
+        self.assertEqual(second.checkout("bb" + "1" * 38, path, 0644, link=True), "copy")
+        self.assertEqual(open(path).read(), "shared")
+
+    def test_concurrent_writers(self):
+        shas = ["%02x" % i + "2" * 38 for i in range(40)]
+        pids = []
+        for worker in range(4):
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    store = objectStore.ObjectStore(self.objects_folder)
+                    for sha in shas[worker::2]:
+                        self.write(store, sha, sha)
+                        if worker == 0:
+                            store.pack_objects()
+                    status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+        for pid in pids:
+            self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        store = objectStore.ObjectStore(self.objects_folder)
+        for sha in shas:
+            self.assertEqual(store.read(sha), sha)
+
+    def test_collect_garbage(self):
+        def tree(sha, elems):
+            data = json.dumps({"sha": sha, "tree": [{"type": kind, "sha": x} for (kind, x) in elems]})
+            self.store.write(sha, lambda data_file: data_file.write(data), "tree")
+
+        blobs = ["%02x" % i + "3" * 38 for i in range(6)]
+        for sha in blobs[:5]:
+            self.write(self.store, sha, "x" * 10)
+        tree("f1" + "3" * 38, [("blob", blobs[0])])
+        tree("f0" + "3" * 38, [("tree", "f1" + "3" * 38), ("blob", blobs[1]), ("tree", "f2" + "3" * 38)])
+        keep = self.store.reachable(["f0" + "3" * 38])
+        self.assertEqual(keep, set(["f0" + "3" * 38, "f1" + "3" * 38, "f2" + "3" * 38, blobs[0], blobs[1]]))
+
+        # The least recently used objects go first, until the budget is met.
+        self.store.pack_objects()
+        self.write(self.store, blobs[5], "x" * 10)
+        size = sum(os.path.getsize(self.store.get_file(x)) for x in [blobs[5]]) + os.path.getsize(self.store.get_pack_file())
+        self.assertEqual(self.store.collect_garbage(keep, size - 20), (2, 20))
+        store = objectStore.ObjectStore(self.objects_folder)
+        self.assertEqual([store.contains(x) for x in blobs], [True, True, False, False, True, True])
+        self.assertEqual(store.read(blobs[4]), "x" * 10)
+        self.assertEqual(json.loads(store.read("f0" + "3" * 38))["sha"], "f0" + "3" * 38)
+
+        # Objects used recently enough are kept.
+        self.assertEqual(store.collect_garbage(keep, 0, 3600), (0, 0))
+        self.assertEqual(store.collect_garbage(keep), (2, 20))
+        self.assertEqual([store.contains(x) for x in blobs], [True, True, False, False, False, False])
+        self.assertEqual(store.read(blobs[0]), "x" * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
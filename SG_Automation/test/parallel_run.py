@@ -0,0 +1,195 @@
+#!/usr/bin/env python -u
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestRailStub:
+    """
+    Stand-in for testrail.APIClient.
+    """
+
+    def __init__(self, tests, failures=0):
+        self.tests = tests
+        self.failures = failures
+        self.posts = []
+
+    def send_get(self, uri):
+        return self.tests
+
+    def send_post(self, uri, data):
+        if self.failures:
+            self.failures -= 1
+            raise IOError("TestRail is down")
+        self.posts.append((uri, data))
+
+
+class TestParallelRun(unittest.TestCase):
+    cases = {
+        1: "#!/bin/bash\necho one > $BUILD_FOLDER/report.txt\nsleep 1\n",
+        2: "#!/bin/bash\necho two > $BUILD_FOLDER/report.txt\nsleep 1\nexit 1\n",
+        3: "#!/bin/bash\necho three > $BUILD_FOLDER/report.txt\nsleep 1\n",
+    }
+
+    def setUp(self):
+        self.stub = GitHubStub({"test": {"selenium": {}}})
+        self.work_folder = tempfile.mkdtemp()
+        self.sandbox = SeleniumSandbox.SeleniumSandbox("token", github_url=self.stub.url, work_folder=self.work_folder)
+        self.sandbox.target_url = "http://site.shotgunstudio.com"
+        (self.sandbox.target_version_name, self.sandbox.target_version_hash) = ("7.0.0", "abcdef0")
+        self.sandbox.testrail_runs = {42: {"name": "Nightly", "plan_id": None}}
+        tests = [{"id": 100 + case_id, "case_id": case_id, "title": "[Automation] C%d" % case_id, "status_id": 3} for case_id in self.cases]
+        tests.append({"id": 200, "case_id": 9, "title": "[Automation] C9", "status_id": 3})
+        self.sandbox.testrail = TestRailStub(tests)
+        self.sandbox.available_cases = {}
+        for (case_id, script) in self.cases.items():
+            case_folder = os.path.join(self.work_folder, "suites", "C%d" % case_id)
+            os.makedirs(case_folder)
+            command = os.path.join(case_folder, "runTest.command")
+            with open(command, "w") as data_file:
+                data_file.write(script)
+            os.chmod(command, 0755)
+            self.sandbox.available_cases[case_id] = case_folder
+
+    def tearDown(self):
+        self.sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def test_tests_run_in_parallel(self):
+        start_time = time.time()
+        self.sandbox.execute_run(42, commit=True, jobs=3)
+        self.assertTrue(time.time() - start_time < 2.5)
+
+        ((uri, data),) = self.sandbox.testrail.posts
+        self.assertEqual(uri, "add_results_for_cases/42")
+        results = dict((x["case_id"], x) for x in data["results"])
+        self.assertEqual(dict((x, results[x]["status_id"]) for x in results), {1: 1, 2: 5, 3: 1, 9: 4})
+        self.assertEqual(results[3]["elapsed"], "1s")
+
+        build_folder = os.path.join(self.work_folder, "build", "site.shotgunstudio.com")
+        (timestamp,) = os.listdir(build_folder)
+        for (case_id, name) in ((1, "one"), (2, "two"), (3, "three")):
+            report = os.path.join(build_folder, timestamp, "C%d" % case_id, "report.txt")
+            self.assertEqual(open(report).read(), name + "\n")
+
+    def test_results_committed_in_batches(self):
+        journal_file = os.path.join(self.work_folder, "results.jsonl")
+        client = TestRailStub([], failures=1)
+        committer = SeleniumSandbox.ResultCommitter(client, journal_file, batch_size=2, interval=60, backoff=0)
+        for case_id in (1, 2):
+            committer.add(42, {"case_id": case_id, "status_id": 1})
+        for i in range(20):
+            if client.posts:
+                break
+            time.sleep(0.1)
+        # The first batch is committed, once retried, before the run ends.
+        self.assertEqual([x["case_id"] for x in client.posts[0][1]["results"]], [1, 2])
+        committer.add(42, {"case_id": 3, "status_id": 1})
+        self.assertEqual(committer.close(), 0)
+        self.assertEqual([x["case_id"] for x in client.posts[1][1]["results"]], [3])
+        self.assertEqual(committer.committed, 3)
+
+        # Nothing is left to commit from the journal, but what was not sent.
+        with open(journal_file, "a") as data_file:
+            data_file.write(json.dumps({"type": "result", "run": 42, "result": {"case_id": 4, "status_id": 5}}) + "\n")
+            data_file.write('{"type": "res')
+        client = TestRailStub([])
+        committer = SeleniumSandbox.ResultCommitter(client, os.path.join(self.work_folder, "resumed.jsonl"))
+        self.assertEqual(committer.resume(journal_file), 1)
+        self.assertEqual(committer.close(), 0)
+        self.assertEqual(client.posts, [("add_results_for_cases/42", {"results": [{"case_id": 4, "status_id": 5}]})])
+
+    def test_results_replayed_once(self):
+        journal_file = os.path.join(self.work_folder, "results.jsonl")
+        committer = SeleniumSandbox.ResultCommitter(TestRailStub([], failures=100), journal_file)
+        for case_id in (1, 2, 3):
+            committer.add(42, {"case_id": case_id, "status_id": 1})
+        committer.add(43, {"case_id": 1, "status_id": 5})
+        # Closing makes a single attempt, leaving the results in the journal.
+        start_time = time.time()
+        self.assertEqual(committer.close(), 4)
+        self.assertTrue(time.time() - start_time < 1)
+        self.assertEqual(committer.client.failures, 99)
+
+        # Replaying the journal twice commits its results once.
+        for count in (4, 0):
+            client = TestRailStub([])
+            committer = SeleniumSandbox.ResultCommitter(client, journal_file)
+            self.assertEqual(committer.resume(journal_file), count)
+            self.assertEqual(committer.close(), 0)
+            self.assertEqual(sum(len(data["results"]) for (uri, data) in client.posts), count)
+
+    def test_longest_tests_first(self):
+        history = self.sandbox.duration_history
+        history.record(2, "7.0.0", 1.0)
+        history.record(1, "6.3.0", 0.2)
+        tests = dict((100 + x, {"case_id": x}) for x in self.cases)
+        self.assertEqual(self.sandbox.schedule_tests(tests, 2), ([102, 103, 101], 1.0, 1))
+        self.assertEqual(self.sandbox.schedule_tests(tests, 1), ([102, 103, 101], 1.8, 1))
+
+        self.sandbox.execute_run(42, jobs=3)
+        history = SeleniumSandbox.DurationHistory(history.history_file)
+        for case_id in self.cases:
+            self.assertTrue(0.9 < history.estimate(case_id, "7.0.0") < 2)
+        self.assertEqual(history.estimate(1, "6.3.0"), 0.2)
+        self.assertEqual(SeleniumSandbox.format_duration(3725), "1h02m05s")
+
+    def test_shards(self):
+        case_ids = range(1, 50)
+        history_file = os.path.join(self.work_folder, "durations.json")
+        history = SeleniumSandbox.DurationHistory(history_file)
+        for case_id in case_ids[::3]:
+            history.record(case_id, "7.0.0", float(case_id % 7))
+        history.save()
+        for weighted in (False, True):
+            shards = []
+            for shard_index in range(3):
+                # Every agent has durations of its own, but weighted shards
+                # only read the history they are given.
+                self.sandbox.duration_history = SeleniumSandbox.DurationHistory(os.path.join(self.work_folder, "local_%d.json" % shard_index))
+                for case_id in case_ids[shard_index::4]:
+                    self.sandbox.duration_history.record(case_id, "7.0.0", 100.0 * shard_index + case_id)
+                self.sandbox.set_shard(shard_index, 3, SeleniumSandbox.DurationHistory(history_file) if weighted else None)
+                shards.append(self.sandbox.get_shard_cases(case_ids))
+            self.assertEqual(sorted(shards[0] | shards[1] | shards[2]), case_ids)
+            self.assertEqual(sum(len(x) for x in shards), len(case_ids))
+            self.assertTrue(min(len(x) for x in shards) > 5)
+
+        # Every shard runs and saves its own results, which are merged, and
+        # records the durations of its cases apart from the history it was
+        # set with.
+        content = open(history_file).read()
+        result_files = []
+        for shard_index in range(2):
+            self.sandbox.duration_history = SeleniumSandbox.DurationHistory(os.path.join(self.work_folder, "local_%d.json" % shard_index))
+            self.sandbox.set_shard(shard_index, 2, SeleniumSandbox.DurationHistory(history_file))
+            results = self.sandbox.execute_run(42, commit=True)
+            result_files.append(os.path.join(self.work_folder, "results_%d.json" % shard_index))
+            SeleniumSandbox.save_results(result_files[-1], {42: results})
+            local = SeleniumSandbox.DurationHistory(self.sandbox.duration_history.history_file)
+            for result in results["results"]:
+                if result["case_id"] in self.cases:
+                    self.assertTrue(0.9 < local.estimate(result["case_id"], "7.0.0") < 2)
+        self.assertEqual(open(history_file).read(), content)
+        posted = [set(x["case_id"] for x in data["results"]) for (uri, data) in self.sandbox.testrail.posts]
+        self.assertEqual(posted[0] & posted[1], set())
+        merged = SeleniumSandbox.merge_results(result_files)
+        self.assertEqual(merged.keys(), [42])
+        self.assertEqual(sorted(x["case_id"] for x in merged[42]["results"]), [1, 2, 3, 9])
+        self.assertEqual(len(os.listdir(os.path.join(self.work_folder, "build", "site.shotgunstudio.com"))), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python -u
+
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestParallelSuites(unittest.TestCase):
+    suites = {
+        "suites/fast": "#!/bin/bash\necho fast $BUILD_FOLDER\nsleep 0.5\n",
+        "suites/slow": "#!/bin/bash\necho slow >&2\nsleep 0.5\nexit 3\n",
+        "suites/stuck": "#!/bin/bash\nsleep 30 &\necho $! > $BUILD_FOLDER/child.pid\nwait\n",
+    }
+
+    def setUp(self):
+        self.stub = GitHubStub({"test": {"selenium": {}}})
+        self.work_folder = tempfile.mkdtemp()
+        self.sandbox = SeleniumSandbox.SeleniumSandbox("token", github_url=self.stub.url, work_folder=self.work_folder)
+        self.sandbox.target_url = "http://site.shotgunstudio.com"
+        self.sandbox.available_suites = {}
+        for (suite, script) in self.suites.items():
+            os.makedirs(os.path.join(self.work_folder, suite))
+            command = os.path.join(self.work_folder, suite, "runTest.command")
+            with open(command, "w") as data_file:
+                data_file.write(script)
+            os.chmod(command, 0755)
+            self.sandbox.available_suites[suite] = command
+
+    def tearDown(self):
+        self.sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def is_running(self, pid):
+        # Killed orphans may stay zombies when nothing reaps them.
+        try:
+            with open("/proc/%d/stat" % pid) as data_file:
+                return data_file.read().rpartition(")")[2].split()[0] != "Z"
+        except IOError:
+            try:
+                os.kill(pid, 0)
+            except OSError:
+                return False
+            return True
+
+    def test_suites_run_in_parallel(self):
+        start_time = time.time()
+        codes = self.sandbox.execute_suites(["suites/fast", "suites/slow"], jobs=2)
+        self.assertTrue(time.time() - start_time < 1)
+        self.assertEqual(codes, {"suites/fast": 0, "suites/slow": 3})
+
+        build_folder = os.path.join(self.work_folder, "build", "site.shotgunstudio.com")
+        (timestamp,) = os.listdir(build_folder)
+        fast_folder = os.path.join(build_folder, timestamp, "suites_fast")
+        self.assertEqual(open(os.path.join(fast_folder, "stdout.log")).read(), "fast %s\n" % fast_folder)
+        slow_folder = os.path.join(build_folder, timestamp, "suites_slow")
+        self.assertEqual(open(os.path.join(slow_folder, "stderr.log")).read(), "slow\n")
+
+    def test_interrupt_kills_process_groups(self):
+        def interrupt(sig, frm):
+            raise KeyboardInterrupt()
+
+        handler = signal.signal(signal.SIGALRM, interrupt)
+        signal.setitimer(signal.ITIMER_REAL, 0.25)
+        start_time = time.time()
+        try:
+            self.assertRaises(KeyboardInterrupt, self.sandbox.execute_suites, ["suites/stuck", "suites/fast", "suites/slow"], 2)
+        finally:
+            signal.signal(signal.SIGALRM, handler)
+        self.assertTrue(time.time() - start_time < 5)
+
+        build_folder = os.path.join(self.work_folder, "build", "site.shotgunstudio.com")
+        (timestamp,) = os.listdir(build_folder)
+        with open(os.path.join(build_folder, timestamp, "suites_stuck", "child.pid")) as data_file:
+            pid = int(data_file.read())
+        for i in range(20):
+            if not self.is_running(pid):
+                break
+            time.sleep(0.1)
+        self.assertFalse(self.is_running(pid))
+        # The suite still queued is not started.
+        self.assertFalse(os.path.exists(os.path.join(build_folder, timestamp, "suites_slow", "stdout.log")))
+
+
+if __name__ == '__main__':
+    unittest.main()
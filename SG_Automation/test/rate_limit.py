@@ -0,0 +1,78 @@
+#!/usr/bin/env python -u
+
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = GitHubStub({"test": {"selenium": {"suites": {"runTest.command": "#!/bin/bash\n"}}}})
+        self.sandbox = SeleniumSandbox.SeleniumSandbox("token", github_url=self.stub.url)
+        self.sandbox.rate_limiter.backoff = 0.1
+
+    def tearDown(self):
+        self.sandbox.http_pool.close()
+        self.stub.stop()
+
+    def test_headers_are_recorded(self):
+        reset = int(time.time()) + 3600
+        self.stub.headers = [("X-RateLimit-Limit", "5000"), ("X-RateLimit-Remaining", "4321"), ("X-RateLimit-Reset", str(reset))]
+        self.sandbox.get_elems("%s/user" % self.stub.url)
+        limiter = self.sandbox.rate_limiter
+        self.assertEqual((limiter.limit, limiter.remaining, limiter.reset, limiter.in_flight), (5000, 4321, reset, 0))
+
+    def test_secondary_limit_is_retried(self):
+        self.stub.requests = []
+        self.stub.failures = [
+            (403, [], '{"message": "You have exceeded a secondary rate limit."}'),
+            (429, [("Retry-After", "0")], "{}"),
+        ]
+        self.assertEqual(self.sandbox.get_elems("%s/user" % self.stub.url)["login"], "stub")
+        self.assertEqual(len(self.stub.requests), 3)
+
+    def test_exhausted_limit_waits_for_reset(self):
+        reset = int(time.time()) + 1
+        self.stub.failures = [(403, [("X-RateLimit-Remaining", "0"), ("X-RateLimit-Reset", str(reset))], '{"message": "API rate limit exceeded"}')]
+        self.sandbox.get_elems("%s/user" % self.stub.url)
+        self.assertTrue(time.time() >= reset)
+
+    def test_too_many_retries(self):
+        self.sandbox.rate_limiter.max_retries = 1
+        self.stub.failures = [(429, [("Retry-After", "0")], "{}")] * 2
+        self.assertRaises(SeleniumSandbox.GitHubRateLimitExceeded, self.sandbox.get_elems, "%s/user" % self.stub.url)
+
+    def test_forbidden_is_not_retried(self):
+        self.stub.failures = [(403, [], '{"message": "Must have admin rights to Repository."}')]
+        try:
+            self.sandbox.get_elems("%s/user" % self.stub.url)
+            self.fail("GitHubError not raised")
+        except SeleniumSandbox.GitHubRateLimitExceeded:
+            self.fail("Not a rate limit")
+        except SeleniumSandbox.GitHubError:
+            pass
+
+    def test_low_budget_is_paced(self):
+        limiter = SeleniumSandbox.RateLimiter(reserve=10)
+        now = time.time()
+        limiter.limit = 5000
+        limiter.remaining = 110
+        limiter.reset = now + 100
+        limiter.last_request = now
+        self.assertAlmostEqual(limiter.delay(now), 1.0, places=2)
+        limiter.remaining = 10
+        self.assertTrue(limiter.delay(now) > 100)
+        limiter.remaining = 4000
+        self.assertEqual(limiter.delay(now), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+#!/usr/bin/env python -u
+
+import hashlib
+import os
+import StringIO
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class CountingHashlib:
+    """
+    Stand-in for hashlib counting the hashed files.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def sha1(self, data):
+        self.count += 1
+        return hashlib.sha1(data)
+
+
+class TestSyncFilesystem(unittest.TestCase):
+    files = {
+        "test": {
+            "selenium": {
+                "library": {"common.js": "var common = 1;\n"},
+                "suites": {
+                    "config": {"config.defaults.xml": "<testdata/>\n"},
+                    "smoke": {
+                        "C1234": {"runTest.command": "#!/bin/bash\n", "suite.html": "<html/>\n"},
+                        "runTest.command": "#!/bin/bash\n",
+                    },
+                },
+            },
+        },
+    }
+
+    def setUp(self):
+        self.stub = GitHubStub(self.files)
+        self.work_folder = tempfile.mkdtemp()
+        self.sandbox = SeleniumSandbox.SeleniumSandbox("token", github_url=self.stub.url, work_folder=self.work_folder)
+        self.sandbox.shotgun_version = self.stub.root
+        self.sandbox.fetch_tree(self.stub.find("test/selenium"))
+        self.hashlib = CountingHashlib()
+        SeleniumSandbox.hashlib = self.hashlib
+
+    def tearDown(self):
+        SeleniumSandbox.hashlib = hashlib
+        self.sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def path(self, *names):
+        return os.path.join(self.work_folder, *names)
+
+    def test_unchanged_files_are_not_hashed(self):
+        self.sandbox.sync_filesystem()
+        self.assertEqual(self.hashlib.count, 0)
+        self.sandbox.sync_filesystem()
+        self.assertEqual(self.hashlib.count, 0)
+
+    def test_changed_files_are_restored(self):
+        self.sandbox.sync_filesystem()
+        with open(self.path("library", "common.js"), "w") as data_file:
+            data_file.write("var common = 2; // local change\n")
+        self.sandbox.sync_filesystem(full=True)
+        self.assertEqual(self.hashlib.count, 1)
+        self.assertEqual(open(self.path("library", "common.js")).read(), "var common = 1;\n")
+
+    def test_files_without_index_are_hashed(self):
+        self.sandbox.sync_filesystem()
+        os.remove(self.path(".git", "index.json"))
+        self.sandbox.sync_filesystem(full=True)
+        self.assertEqual(self.hashlib.count, 5)
+        self.sandbox.sync_filesystem(full=True)
+        self.assertEqual(self.hashlib.count, 5)
+
+    def test_same_tree_is_skipped(self):
+        self.sandbox.sync_filesystem()
+        os.remove(self.path("library", "common.js"))
+        self.sandbox.sync_filesystem()
+        self.assertFalse(os.path.exists(self.path("library", "common.js")))
+        self.sandbox.sync_filesystem(full=True)
+        self.assertTrue(os.path.exists(self.path("library", "common.js")))
+
+    def test_version_bump_applies_differences(self):
+        self.sandbox.sync_filesystem()
+        with open(self.path("suites", "config", "config.defaults.xml"), "w") as data_file:
+            data_file.write("<testdata local='change'/>\n")
+
+        selenium = self.files["test"]["selenium"]
+        smoke = dict(selenium["suites"]["smoke"])
+        smoke["C1234"] = {"runTest.command": "#!/bin/bash\n"}
+        smoke["C5678"] = {"runTest.command": "#!/bin/bash\n"}
+        files = {"test": {"selenium": {
+            "library": "not a folder anymore\n",
+            "suites": {"config": selenium["suites"]["config"], "smoke": smoke},
+        }}}
+        self.sandbox.shotgun_version = self.stub.add_tree(files)
+        self.sandbox.fetch_tree(self.sandbox.find_tree(self.sandbox.shotgun_version, "test/selenium"))
+        self.sandbox.sync_filesystem()
+
+        self.assertEqual(open(self.path("library")).read(), "not a folder anymore\n")
+        self.assertFalse(os.path.exists(self.path("suites", "smoke", "C1234", "suite.html")))
+        self.assertTrue(os.access(self.path("suites", "smoke", "C5678", "runTest.command"), os.X_OK))
+        self.assertEqual(sorted(self.sandbox.available_cases.keys()), [1234, 5678])
+        # Unchanged sub-trees are not looked at.
+        self.assertEqual(open(self.path("suites", "config", "config.defaults.xml")).read(), "<testdata local='change'/>\n")
+        self.assertEqual(self.sandbox.get_synced_tree(), self.sandbox.find_tree(self.sandbox.shotgun_version, "test/selenium"))
+
+    def test_mode_change_is_applied(self):
+        for checkout_mode in ("copy", "link"):
+            self.sandbox.checkout_mode = checkout_mode
+            self.sandbox.shotgun_version = self.stub.root
+            self.sandbox.sync_filesystem(full=True)
+            self.assertFalse(os.access(self.path("library", "common.js"), os.X_OK))
+
+            selenium = self.files["test"]["selenium"]
+            files = {"test": {"selenium": {
+                "library": {"common.js": (selenium["library"]["common.js"], "100755")},
+                "suites": selenium["suites"],
+            }}}
+            self.sandbox.shotgun_version = self.stub.add_tree(files)
+            self.sandbox.fetch_tree(self.sandbox.find_tree(self.sandbox.shotgun_version, "test/selenium"))
+            self.sandbox.sync_filesystem()
+            self.assertTrue(os.access(self.path("library", "common.js"), os.X_OK))
+            self.assertEqual(open(self.path("library", "common.js")).read(), "var common = 1;\n")
+
+    def test_output_does_not_depend_on_workers(self):
+        outputs = []
+        for workers in (1, 8):
+            shutil.rmtree(self.work_folder + os.path.sep + "suites", ignore_errors=True)
+            shutil.rmtree(self.work_folder + os.path.sep + "library", ignore_errors=True)
+            self.sandbox.sync_workers = workers
+            stdout = sys.stdout
+            sys.stdout = StringIO.StringIO()
+            try:
+                self.sandbox.sync_filesystem(full=True)
+                outputs.append(sys.stdout.getvalue())
+            finally:
+                sys.stdout = stdout
+        self.assertEqual(outputs[0], outputs[1])
+        self.assertIn("creating file: " + self.path("suites", "smoke", "C1234", "suite.html"), outputs[0])
+
+    def test_link_checkout(self):
+        self.sandbox.checkout_mode = "link"
+        self.sandbox.sync_filesystem()
+        stats = self.sandbox.get_checkout_stats()
+        self.assertEqual(sum(stats.values()), 5)
+        self.assertTrue(stats["reflink"] + stats["hardlink"] >= 3)
+        self.assertTrue(os.access(self.path("suites", "smoke", "runTest.command"), os.X_OK))
+        self.assertEqual(open(self.path("library", "common.js")).read(), "var common = 1;\n")
+        self.sandbox.sync_filesystem(full=True)
+        self.assertEqual(self.hashlib.count, 0)
+
+    def test_collect_garbage(self):
+        self.sandbox.sync_filesystem()
+        old_sha = self.sandbox.get_synced_tree()
+        selenium = self.files["test"]["selenium"]
+        files = {"test": {"selenium": {"library": {"common.js": "var common = 2;\n"}, "suites": selenium["suites"]}}}
+        self.sandbox.shotgun_version = self.stub.add_tree(files)
+        new_sha = self.sandbox.find_tree(self.sandbox.shotgun_version, "test/selenium")
+        self.sandbox.fetch_tree(new_sha)
+        self.sandbox.sync_filesystem()
+        self.sandbox.sync_filesystem()
+        self.assertEqual(SeleniumSandbox.get_synced_trees(self.path(".git"), 5), [new_sha, old_sha])
+
+        SeleniumSandbox.collect_garbage(self.work_folder, keep_trees=2)
+        self.assertTrue(self.sandbox.has_git_object(old_sha))
+        (count, size) = SeleniumSandbox.collect_garbage(self.work_folder, keep_trees=1)
+        self.assertTrue(count >= 3)
+        store = SeleniumSandbox.objectStore.ObjectStore(self.path(".git", "objects"))
+        self.assertFalse(store.contains(old_sha))
+        self.assertFalse(store.contains(hashlib.sha1("blob 16\0var common = 1;\n").hexdigest()))
+        for sha in store.reachable([new_sha]):
+            self.assertTrue(store.contains(sha))
+
+    def test_collect_garbage_keeps_shared_objects(self):
+        shared_folder = self.path("shared")
+        sandboxes = []
+        for site in ("a", "b"):
+            os.mkdir(self.path("site_" + site))
+            sandbox = SeleniumSandbox.SeleniumSandbox("token", github_url=self.stub.url, work_folder=self.path("site_" + site), shared_objects_folder=shared_folder)
+            sandbox.shotgun_version = self.stub.add_tree({"test": {"selenium": {"library": {"site.js": "var site = '%s';\n" % site}}}})
+            sandbox.fetch_tree(sandbox.find_tree(sandbox.shotgun_version, "test/selenium"))
+            sandbox.sync_filesystem()
+            sandbox.http_pool.close()
+            sandboxes.append(sandbox)
+        site_b_objects = sandboxes[1].object_store.reachable([sandboxes[1].get_synced_tree()])
+        shared = SeleniumSandbox.objectStore.ObjectStore(shared_folder)
+
+        # The objects of other work folders are not removed from the shared
+        # cache because this one does not refer to them...
+        SeleniumSandbox.collect_garbage(self.path("site_a"), keep_trees=0, shared_objects_folder=shared_folder)
+        SeleniumSandbox.collect_garbage(self.path("site_a"), 0, 1, shared_folder)
+        self.assertTrue(all(shared.contains(sha) for sha in site_b_objects))
+        # ...only when they were unused for long enough, to fit the budget.
+        SeleniumSandbox.collect_garbage(self.path("site_a"), 0, 1, shared_folder, shared_min_age=0)
+        shared.reload()
+        self.assertFalse(any(shared.contains(sha) for sha in site_b_objects))
+
+    def test_targets_index(self):
+        self.sandbox.sync_filesystem()
+        suites = dict(self.sandbox.available_suites)
+        cases = dict(self.sandbox.available_cases)
+        self.assertEqual(sorted(suites.keys()), ["suites/smoke", "suites/smoke/C1234"])
+        self.assertEqual(cases, {1234: self.path("suites", "smoke", "C1234")})
+
+        # The work folder is not walked once the index is built, and the
+        # index matches what walking it finds.
+        os.remove(self.path(".git", "SYNC_HEAD"))
+        self.sandbox.update_targets()
+        self.assertEqual((self.sandbox.available_suites, self.sandbox.available_cases), (suites, cases))
+        self.sandbox.set_synced_tree(self.sandbox.find_tree(self.sandbox.shotgun_version, "test/selenium"))
+        (locate_files, locate_dirs) = (SeleniumSandbox.locate_files, SeleniumSandbox.locate_dirs)
+        SeleniumSandbox.locate_files = SeleniumSandbox.locate_dirs = None
+        try:
+            self.sandbox.update_targets()
+            os.remove(self.path(".git", "targets.json"))
+            self.sandbox.update_targets()
+        finally:
+            (SeleniumSandbox.locate_files, SeleniumSandbox.locate_dirs) = (locate_files, locate_dirs)
+        self.assertEqual((self.sandbox.available_suites, self.sandbox.available_cases), (suites, cases))
+
+    def test_changed_cases(self):
+        def sync(common, c1234):
+            files = {"test": {"selenium": {
+                "library": {"common.js": common},
+                "suites": {
+                    "smoke": {"C1234": {"runTest.command": c1234}},
+                    "other": {"C5678": {"runTest.command": "#!/bin/bash\n"}},
+                },
+            }}}
+            self.sandbox.shotgun_version = self.stub.add_tree(files)
+            self.sandbox.fetch_tree(self.sandbox.find_tree(self.sandbox.shotgun_version, "test/selenium"))
+            self.sandbox.sync_filesystem()
+
+        sync("var common = 1;\n", "#!/bin/bash\n")
+        self.assertEqual(self.sandbox.get_changed_cases([1234, 5678]), set([1234, 5678]))
+        sync("var common = 1;\n", "#!/bin/bash\nexit 1\n")
+        self.assertEqual(self.sandbox.get_changed_cases([1234, 5678]), set([1234]))
+        self.assertEqual(self.sandbox.get_changed_paths(["suites/smoke", "suites/other"]), set(["suites/smoke"]))
+        sync("var common = 2;\n", "#!/bin/bash\nexit 1\n")
+        self.assertEqual(self.sandbox.get_changed_cases([1234, 5678]), set([1234, 5678]))
+
+
+if __name__ == '__main__':
+    unittest.main()
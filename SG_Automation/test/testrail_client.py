@@ -0,0 +1,221 @@
+#!/usr/bin/env python -u
+
+import BaseHTTPServer
+import json
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+import testrail
+
+from github_stub import GitHubStub, ThreadingHTTPServer
+
+
+class TestRailServerStub:
+    """
+    Local stand-in for the TestRail API.
+
+    Every request is recorded in requests, as (client port, method, path,
+    body), and canned (status, headers, body) responses queued in failures
+    are returned first. API methods found in results are answered with
+    their result after delay seconds, any other with the request itself.
+    Connections are closed after every response while close is set.
+    """
+
+    def __init__(self, results=None, delay=0):
+        """
+        Constructor.
+        """
+        self.requests = []
+        self.failures = []
+        self.results = results or {}
+        self.delay = delay
+        self.close = False
+        stub = self
+
+        class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                self.respond(None)
+
+            def do_POST(self):
+                self.respond(self.rfile.read(int(self.headers["Content-Length"])))
+
+            def respond(self, body):
+                stub.requests.append((self.client_address[1], self.command, self.path, body))
+                uri = self.path.partition("/api/v2/")[2]
+                if stub.failures:
+                    (status, headers, body) = stub.failures.pop(0)
+                elif uri in stub.results:
+                    time.sleep(stub.delay)
+                    (status, headers, body) = (200, [], json.dumps(stub.results[uri]))
+                else:
+                    (status, headers, body) = (200, [], json.dumps({"path": self.path, "auth": self.headers["Authorization"]}))
+                self.send_response(status)
+                for (key, value) in headers:
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                if stub.close:
+                    self.close_connection = 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = "http://127.0.0.1:%d/" % self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestAPIClient(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = TestRailServerStub()
+        self.client = testrail.APIClient(self.stub.url, timeout=5, backoff=0.01)
+        self.client.user = "qa@example.com"
+        self.client.password = "key"
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.stop()
+
+    def test_connection_is_kept_alive(self):
+        for uri in ("get_user_by_email&email=qa@example.com", "get_projects", "get_runs/3&is_completed=0"):
+            result = self.client.send_get(uri)
+            self.assertEqual(result["path"], "/index.php?/api/v2/" + uri)
+        self.client.send_post("add_results_for_cases/42", {"results": []})
+        self.assertEqual(len(set(port for (port, method, path, body) in self.stub.requests)), 1)
+        self.assertEqual(self.stub.requests[-1][1:], ("POST", "/index.php?/api/v2/add_results_for_cases/42", '{"results": []}'))
+
+        # The credentials can still be changed after the first request.
+        self.client.user = "bot@example.com"
+        self.assertEqual(self.client.send_get("get_projects")["auth"], "Basic Ym90QGV4YW1wbGUuY29tOmtleQ==")
+
+    def test_closed_idle_connection_is_replaced(self):
+        self.client.send_get("get_projects")
+        self.client.close()
+        self.client.send_get("get_projects")
+        self.assertEqual(len(set(port for (port, method, path, body) in self.stub.requests)), 2)
+
+    def test_connection_closed_by_server_is_dropped(self):
+        self.stub.close = True
+        self.client.send_get("get_projects")
+        self.stub.close = False
+        time.sleep(0.1)
+        # Not even a write is lost on the connection the server closed.
+        self.client.send_post("add_results_for_cases/42", {"results": []})
+        self.assertEqual(len(self.stub.requests), 2)
+        self.assertEqual(len(set(port for (port, method, path, body) in self.stub.requests)), 2)
+
+    def test_server_errors_are_retried(self):
+        self.stub.failures = [
+            (503, [], "<html>Service Unavailable</html>"),
+            (429, [("Retry-After", "0")], json.dumps({"error": "Too many requests"})),
+        ]
+        self.assertEqual(self.client.send_get("get_runs/3")["path"], "/index.php?/api/v2/get_runs/3")
+        self.assertEqual(len(self.stub.requests), 3)
+
+        stats = self.client.get_stats()
+        self.assertEqual(sorted(stats.keys()), ["get_runs"])
+        self.assertEqual((stats["get_runs"]["count"], stats["get_runs"]["retries"]), (1, 2))
+        self.assertTrue(stats["get_runs"]["max"] >= stats["get_runs"]["total"] > 0)
+
+    def test_too_many_writes_are_retried(self):
+        self.stub.failures = [(429, [("Retry-After", "0")], json.dumps({"error": "Too many requests"}))]
+        self.client.send_post("add_results_for_cases/42", {"results": []})
+        posts = [x for x in self.stub.requests if x[1] == "POST"]
+        self.assertEqual(len(posts), 2)
+        self.assertEqual(self.client.get_stats()["add_results_for_cases"]["retries"], 1)
+
+    def test_errors(self):
+        self.stub.failures = [(400, [], json.dumps({"error": "Field :run_id is not a valid test run."}))]
+        with self.assertRaises(testrail.APIError) as context:
+            self.client.send_get("get_tests/0")
+        self.assertEqual(context.exception.code, 400)
+        self.assertEqual(len(self.stub.requests), 1)
+
+        self.client.max_retries = 1
+        self.stub.failures = [(502, [], "<html>Bad Gateway</html>")] * 2
+        with self.assertRaises(testrail.APIError) as context:
+            self.client.send_get("get_tests/1")
+        self.assertEqual(context.exception.code, 502)
+        self.assertEqual(self.client.get_stats()["get_tests"]["count"], 2)
+
+        # Writes may have been applied, and are never sent twice.
+        self.stub.failures = [(503, [], "<html>Service Unavailable</html>")]
+        with self.assertRaises(testrail.APIError) as context:
+            self.client.send_post("add_results_for_cases/42", {"results": []})
+        self.assertEqual(context.exception.code, 503)
+        self.assertEqual(len([x for x in self.stub.requests if x[1] == "POST"]), 1)
+
+
+class TestLazyListings(unittest.TestCase):
+    results = {
+        "get_user_by_email&email=qa@example.com": {"id": 1, "name": "QA"},
+        "get_projects": [{"id": 3, "name": "Maya"}, {"id": 5, "name": "Shotgun"}],
+        "get_runs/5&is_completed=0": [{"id": 42, "name": "Nightly", "plan_id": None}],
+        "get_plans/5&is_completed=0": [{"id": 7, "name": "Release"}],
+        "get_suites/5": [{"id": 1, "name": "Master"}],
+    }
+
+    def setUp(self):
+        self.github = GitHubStub({"test": {"selenium": {}}})
+        self.stub = TestRailServerStub(self.results, delay=0.5)
+        self.sandbox = None
+
+    def tearDown(self):
+        if self.sandbox is not None:
+            self.sandbox.http_pool.close()
+            self.sandbox.testrail.close()
+        self.github.stop()
+        self.stub.stop()
+
+    def test_listings_are_loaded_concurrently_on_first_use(self):
+        self.sandbox = SeleniumSandbox.SeleniumSandbox(
+            "token", "qa@example.com:key", testrail_server=self.stub.url, github_url=self.github.url
+        )
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(self.sandbox.get_testrail_user(), "QA")
+
+        start_time = time.time()
+        self.assertEqual(self.sandbox.testrail_plans.keys(), [7])
+        # The project lookup, then the three listings at once.
+        self.assertTrue(time.time() - start_time < 1.4)
+        self.assertEqual(self.sandbox.testrail_project_id, 5)
+        self.assertTrue(self.sandbox.is_testrail_run(42))
+        self.assertEqual(self.sandbox.testrail_suites.keys(), [1])
+        self.assertEqual(len(self.stub.requests), 5)
+
+    def test_unknown_project(self):
+        self.sandbox = SeleniumSandbox.SeleniumSandbox(
+            "token", "qa@example.com:key", testrail_server=self.stub.url, testrail_project="Flame", github_url=self.github.url
+        )
+        with self.assertRaises(SeleniumSandbox.TestRailShotgunProjectNotFound):
+            self.sandbox.testrail_runs
+
+    def test_server_not_found(self):
+        self.stub.stop()
+        self.assertRaises(
+            SeleniumSandbox.TestRailServerNotFound, SeleniumSandbox.SeleniumSandbox,
+            "token", "qa@example.com:key", testrail_server=self.stub.url, github_url=self.github.url
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
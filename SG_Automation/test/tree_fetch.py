@@ -0,0 +1,86 @@
+#!/usr/bin/env python -u
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import SeleniumSandbox
+
+from github_stub import GitHubStub
+
+
+class TestTreeFetch(unittest.TestCase):
+    files = {
+        "test": {
+            "selenium": {
+                "library": {"common.js": "var common = 1;\n", "utils": {"dom.js": "var dom = 1;\n"}},
+                "suites": {
+                    "smoke": {
+                        "C1234": {"runTest.command": "#!/bin/bash\n", "suite.html": "<html/>\n"},
+                        "runTest.command": "#!/bin/bash\n",
+                    },
+                },
+            },
+        },
+    }
+
+    def setUp(self):
+        self.stub = GitHubStub(self.files)
+        self.work_folder = tempfile.mkdtemp()
+        self.sandbox = SeleniumSandbox.SeleniumSandbox("token", fetch_mode="recursive", github_url=self.stub.url)
+        self.sandbox.set_work_folder(self.work_folder)
+        self.selenium = self.stub.find("test/selenium")
+        del self.stub.requests[:]
+
+    def tearDown(self):
+        self.sandbox.http_pool.close()
+        self.stub.stop()
+        shutil.rmtree(self.work_folder)
+
+    def subtrees(self, sha):
+        """
+        SHA-1 of a tree and of all the trees below it.
+        """
+        shas = [sha]
+        for elem in self.stub.trees[sha]["tree"]:
+            if elem["type"] == "tree":
+                shas += self.subtrees(elem["sha"])
+        return shas
+
+    def assert_tree_stored(self, sha):
+        """
+        Check a tree and its sub-trees are stored as served by GitHub.
+        """
+        expected = self.stub.resolve(self.stub.trees[sha])
+        self.assertEqual(self.sandbox.get_tree(sha)["tree"], expected["tree"])
+        for elem in expected["tree"]:
+            if elem["type"] == "tree":
+                self.assert_tree_stored(elem["sha"])
+            else:
+                self.assertTrue(self.sandbox.has_git_object(elem["sha"]))
+
+    def test_recursive_listing_is_split_into_trees(self):
+        self.sandbox.fetch_tree(self.selenium)
+        trees = [x for x in self.stub.requests if "/git/trees/" in x]
+        self.assertEqual(trees, ["/%s/git/trees/%s?recursive=1" % (self.stub.repo, self.selenium)])
+        self.assert_tree_stored(self.selenium)
+        self.assertEqual(len(self.subtrees(self.selenium)), 6)
+
+    def test_truncated_listing_walks_the_tree(self):
+        truncated = {"sha": self.selenium, "url": "", "tree": [], "truncated": True}
+        self.stub.failures.append((200, [], json.dumps(truncated)))
+        self.sandbox.fetch_tree(self.selenium)
+        trees = [x for x in self.stub.requests if "/git/trees/" in x]
+        # The truncated listing, then every tree on its own.
+        self.assertEqual(trees[0], "/%s/git/trees/%s?recursive=1" % (self.stub.repo, self.selenium))
+        self.assertEqual(sorted(x.rpartition("/")[2] for x in trees[1:]), sorted(self.subtrees(self.selenium)))
+        self.assert_tree_stored(self.selenium)
+
+
+if __name__ == '__main__':
+    unittest.main()
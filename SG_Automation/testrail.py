@@ -10,15 +10,25 @@
 # Copyright Gurock Software GmbH. See license.md for details.
 #
 
-import urllib2, json, base64
+import json, base64
+import httplib, random, re, select, socket, threading, time, urlparse
 
 class APIClient:
-	def __init__(self, base_url):
+	def __init__(self, base_url, timeout=60, pool_size=4, max_retries=5, backoff=1, max_backoff=60):
 		self.user = ''
 		self.password = ''
 		if not base_url.endswith('/'):
 			base_url += '/'
 		self.__url = base_url + 'index.php?/api/v2/'
+		self.timeout = timeout
+		self.pool_size = pool_size
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.max_backoff = max_backoff
+		self.__lock = threading.Lock()
+		self.__idle = []
+		self.__auth = (None, None, None)
+		self.__stats = {}
 
 	#
 	# Send Get
@@ -50,35 +60,138 @@ class APIClient:
 	def send_post(self, uri, data):
 		return self.__send_request('POST', uri, data)
 
+	#
+	# Get Stats
+	#
+	# Returns the latency statistics of the requests sent so far, by API
+	# method (e.g. get_runs): the number of requests and of retries, and
+	# the total and maximum time in seconds, retries included.
+	#
+	def get_stats(self):
+		with self.__lock:
+			return dict((endpoint, dict(stats)) for (endpoint, stats) in self.__stats.items())
+
+	#
+	# Close
+	#
+	# Closes the kept-alive connections to the server.
+	#
+	def close(self):
+		with self.__lock:
+			idle = self.__idle
+			self.__idle = []
+		for connection in idle:
+			connection.close()
+
 	def __send_request(self, method, uri, data):
 		url = self.__url + uri
-		request = urllib2.Request(url)
+		body = None
 		if (method == 'POST'):
-			request.add_data(json.dumps(data))
-		auth = base64.b64encode('%s:%s' % (self.user, self.password))
-		request.add_header('Authorization', 'Basic %s' % auth)
-		request.add_header('Content-Type', 'application/json')
+			body = json.dumps(data)
+		headers = {
+			'Authorization': 'Basic %s' % self.__get_auth(),
+			'Content-Type': 'application/json'
+		}
 
-		e = None
-		try:
-			response = urllib2.urlopen(request).read()
-		except urllib2.HTTPError as e:
-			response = e.read()
+		# Requests answered with too many requests, which the server turned
+		# down, and reads answered with a server error are retried, after a
+		# growing delay randomized so that clients do not retry together.
+		# Writes failing with a server error are not, as they may have been
+		# applied.
+		start = time.time()
+		attempt = 0
+		while True:
+			(status, response, retry_after) = self.__request(url, method, body, headers)
+			if not (status == 429 or (status >= 500 and method == 'GET')) or attempt >= self.max_retries:
+				break
+			attempt += 1
+			delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+			delay = random.uniform(delay / 2.0, delay)
+			if retry_after and retry_after.isdigit():
+				# No sooner than the server asks, still randomized.
+				delay += int(retry_after)
+			time.sleep(delay)
+		self.__record(re.split('[/&]', uri)[0], time.time() - start, attempt)
 
-		if response:
-			result = json.loads(response)
-		else:
+		try:
+			result = json.loads(response) if response else {}
+		except ValueError:
+			# Proxies answer errors in HTML.
+			if status < 400:
+				raise
 			result = {}
 
-		if e != None:
+		if status >= 400:
 			if result and 'error' in result:
 				error = '"' + result['error'] + '"'
 			else:
 				error = 'No additional error message received'
-			raise APIError(e.code, error)
+			raise APIError(status, error)
 
 		return result
 
+	def __get_auth(self):
+		# Encoded once for as long as the credentials do not change.
+		with self.__lock:
+			(user, password, auth) = self.__auth
+			if (user, password) != (self.user, self.password):
+				auth = base64.b64encode('%s:%s' % (self.user, self.password))
+				self.__auth = (self.user, self.password, auth)
+			return auth
+
+	def __request(self, url, method, body, headers):
+		parts = urlparse.urlsplit(url)
+		path = urlparse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+		(connection, reused) = self.__acquire(parts.scheme, parts.netloc)
+		while True:
+			try:
+				connection.request(method, path, body, headers)
+				response = connection.getresponse()
+				content = response.read()
+				break
+			except (httplib.HTTPException, socket.error):
+				connection.close()
+				# A kept-alive connection may have been closed by the
+				# server while idle: a read is sent again.
+				if not reused or method != 'GET':
+					raise
+				(connection, reused) = self.__acquire(parts.scheme, parts.netloc, True)
+		if response.will_close:
+			connection.close()
+		else:
+			self.__release(connection)
+		return (response.status, content, response.getheader('Retry-After'))
+
+	def __acquire(self, scheme, netloc, fresh=False):
+		while not fresh:
+			with self.__lock:
+				if not self.__idle:
+					break
+				connection = self.__idle.pop()
+			# An idle connection with something to read was closed by the
+			# server, and is dropped before any request is sent over it.
+			if connection.sock is not None and not select.select([connection.sock], [], [], 0)[0]:
+				return (connection, True)
+			connection.close()
+		if scheme == 'https':
+			return (httplib.HTTPSConnection(netloc, timeout=self.timeout), False)
+		return (httplib.HTTPConnection(netloc, timeout=self.timeout), False)
+
+	def __release(self, connection):
+		with self.__lock:
+			if len(self.__idle) < self.pool_size:
+				self.__idle.append(connection)
+				return
+		connection.close()
+
+	def __record(self, endpoint, elapsed, retries):
+		with self.__lock:
+			stats = self.__stats.setdefault(endpoint, {'count': 0, 'retries': 0, 'total': 0.0, 'max': 0.0})
+			stats['count'] += 1
+			stats['retries'] += retries
+			stats['total'] += elapsed
+			stats['max'] = max(stats['max'], elapsed)
+
 class APIError(Exception):
 	def __init__(self, code, error):
 		self.code = code